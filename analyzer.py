@@ -1,170 +1,744 @@
 """
 MongoDB Query Metrics Analyzer - Analysis Module
 """
-import statistics
-from collections import defaultdict
-from typing import Dict, List, Any, DefaultDict, Tuple
+import heapq
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Any, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from efficiency import IndexPredicates, efficiency_scores
+from ingest import iter_batch_entries
+from profiling import PROFILER
+
+SHAPE_CACHE_SIZE = 65536  # Distinct queryShapeHash values remembered by extract_match_shape
+LOGICAL_OPERATORS = frozenset(("$and", "$or", "$nor"))
+# Pipeline stages that pass documents through unchanged, so a $match or $sort
+# after them still filters or orders the collection's own documents
+PASSTHROUGH_STAGES = frozenset(("$match", "$sort", "$limit", "$skip"))
+# Components of a query shape that results can be grouped by (see describe_query_shape)
+GROUP_KEYS = ("fields", "namespace", "command", "operators", "sort", "projection", "stages")
+DEFAULT_GROUP_BY = ("fields",)
+INTERN_TABLE_SIZE = 4 * SHAPE_CACHE_SIZE  # Distinct grouping components kept canonical
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+ShapeDescription = namedtuple("ShapeDescription", GROUP_KEYS + ("predicates",))
+
+
+class ShapeCache:
+    """Bounded LRU cache of derived shape data keyed by queryShapeHash"""
+
+    def __init__(self, maxsize: int = SHAPE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for `key` (None on a miss), counting the lookup"""
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        """Store `value`, evicting the least recently used entry when full"""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def record(self, hits: int, misses: int):
+        """Add lookup counts observed elsewhere (e.g. in a worker process)"""
+        self.hits += hits
+        self.misses += misses
+
+    def clear(self):
+        """Drop every cached entry and reset the counters"""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+_shape_cache = ShapeCache()
+_group_by = DEFAULT_GROUP_BY
+_interned: Dict[Any, Any] = {}
+
+
+def shape_cache_info() -> CacheInfo:
+    """Hit/miss statistics of the shape extraction cache"""
+    return _shape_cache.info()
+
+
+def configure_shape_cache(maxsize: int):
+    """Resize (and clear) the shape extraction cache"""
+    _shape_cache.clear()
+    _shape_cache.maxsize = maxsize
+
+
+def parse_group_by(text: str) -> Tuple[str, ...]:
+    """Parse a comma-separated list of grouping components, e.g. 'namespace,fields'"""
+    group_by = tuple(name.strip() for name in text.split(",") if name.strip())
+    unknown = [name for name in group_by if name not in GROUP_KEYS]
+    if unknown or not group_by:
+        raise ValueError(f"Unknown grouping key(s) {', '.join(unknown) or '(none)'} "
+                         f"(choose from {', '.join(GROUP_KEYS)})")
+    return group_by
+
+
+def configure_grouping(group_by: Sequence[str] = DEFAULT_GROUP_BY):
+    """Select the components of the shape grouping key (see GROUP_KEYS); clears the shape cache"""
+    global _group_by
+    _group_by = parse_group_by(",".join(group_by))
+    reset_caches()
+
+
+def reset_caches():
+    """Empty the shape cache and the intern table (e.g. so benchmark runs start cold)"""
+    _shape_cache.clear()
+    _interned.clear()
+
+
+def grouping() -> Tuple[str, ...]:
+    """The components of the shape grouping key"""
+    return _group_by
+
+
+def _intern(value: Any) -> Any:
+    """Return the canonical instance of an equal value, so repeated keys share one object"""
+    if len(_interned) >= INTERN_TABLE_SIZE:
+        _interned.clear()  # Only sharing is lost; keys stay equal
+    return _interned.setdefault(value, value)
+
+
+def describe_query_shape(query_shape: Dict) -> ShapeDescription:
+    """Canonicalize a query shape into every grouping component in one walk.
+
+    Aggregations are read from their pipeline (the first $match, $sort and
+    $project stages); find and distinct commands from their filter/query,
+    sort and projection. Field names and components are interned. The
+    index predicates only take a $match or $sort reached through
+    pass-through stages: after a reshaping stage they apply to computed
+    documents, not collection fields.
+    """
+    pipeline = query_shape.get("pipeline")
+    match = sort_spec = projection_spec = None
+    match_indexable = sort_indexable = True
+    if pipeline is not None:
+        stages = []
+        reshaped = False
+        for stage in pipeline:
+            name = next(iter(stage), "") if isinstance(stage, dict) else ""
+            stages.append(name)
+            if name == "$match" and match is None:
+                match = stage[name]
+                match_indexable = not reshaped
+            elif name == "$sort" and sort_spec is None:
+                sort_spec = stage[name]
+                sort_indexable = not reshaped
+            elif name == "$project" and projection_spec is None:
+                projection_spec = stage[name]
+            reshaped = reshaped or name not in PASSTHROUGH_STAGES
+        stages = tuple(stages)
+    else:
+        match = query_shape.get("filter", query_shape.get("query"))
+        sort_spec = query_shape.get("sort")
+        projection_spec = query_shape.get("projection")
+        stages = tuple(name for name in query_shape if name not in ("cmdNs", "command"))
+
+    field_operators = []
+    fields = []
+    signature: Dict[str, set] = {}
+    if isinstance(match, dict):
+        for field_name, operators in get_field_operators(match):
+            field_name = sys.intern(field_name)
+            field_operators.append((field_name, operators))
+            fields.append(field_name)
+            dollar_operators = signature.get(field_name)
+            if dollar_operators is None:
+                dollar_operators = signature[field_name] = set()
+            for operator in operators:
+                if operator.startswith("$"):
+                    dollar_operators.add(operator)
+    # Directions are kept in query shapes; skip e.g. {$meta: "textScore"}
+    sort = ()
+    if isinstance(sort_spec, dict) and sort_spec:
+        sort = tuple((sys.intern(field_name), direction) for field_name, direction in sort_spec.items()
+                     if direction in (1, -1))
+    projection = ()
+    if isinstance(projection_spec, dict) and projection_spec:
+        projection = tuple(sorted(sys.intern(field_name) for field_name in projection_spec))
+
+    namespace = query_shape.get("cmdNs", "")
+    if isinstance(namespace, dict):
+        namespace = f"{namespace.get('db', '')}.{namespace.get('coll', '')}"
+    fields.sort()  # Sort field names for consistent identification
+    field_operators = tuple(field_operators)
+
+    return ShapeDescription(
+        _intern(tuple(fields)),
+        sys.intern(str(namespace)),
+        sys.intern(str(query_shape.get("command", ""))),
+        _intern(tuple((field_name, tuple(sorted(operators))) for field_name, operators in sorted(signature.items()))),
+        _intern(sort),
+        _intern(projection),
+        _intern(stages),
+        (field_operators if match_indexable else (), sort if sort_indexable else (),
+         match_indexable and _has_or(match))
+    )
+
+
+def _has_or(match: Any) -> bool:
+    """Whether a $match expression has an $or, at the top level or within $and/$nor"""
+    stack = [match]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "$or" in node:
+            return True
+        for operator in ("$and", "$nor"):
+            if isinstance(node.get(operator), list):
+                stack.extend(node[operator])
+    return False
+
+
+def group_key(description: ShapeDescription, group_by: Optional[Sequence[str]] = None) -> tuple:
+    """The grouping key of a described query shape.
+
+    Grouping by fields alone (the default) gives the sorted field name
+    tuple itself; otherwise the key holds one value per component.
+    """
+    group_by = group_by or _group_by
+    if group_by == DEFAULT_GROUP_BY:
+        return description.fields
+    return _intern(tuple(getattr(description, name) for name in group_by))
+
+
+def group_labels(key: tuple, group_by: Optional[Sequence[str]] = None) -> Dict[str, str]:
+    """Readable `{component: value}` of a grouping key"""
+    group_by = group_by or _group_by
+    return component_labels(group_by, (key,) if group_by == DEFAULT_GROUP_BY else key)
+
+
+def component_labels(names: Sequence[str], values: Sequence[Any]) -> Dict[str, str]:
+    """Readable `{component: value}` of ShapeDescription components"""
+    labels = {}
+    for name, value in zip(names, values):
+        if name == "operators":
+            labels[name] = ", ".join(f"{field_name} {' '.join(operators)}" for field_name, operators in value)
+        elif name == "sort":
+            labels[name] = ", ".join(f"{field_name}: {direction}" for field_name, direction in value)
+        elif name == "stages":
+            labels[name] = " > ".join(value)
+        elif isinstance(value, tuple):
+            labels[name] = ", ".join(value)
+        else:
+            labels[name] = value
+    return labels
+
+
+def group_field_names(key: tuple, predicates: IndexPredicates) -> List[str]:
+    """The field names of a group: from its key when it has them, else those seen in its predicates"""
+    if _group_by == DEFAULT_GROUP_BY:
+        return list(key)
+    for name in ("fields", "operators"):
+        if name in _group_by:
+            value = key[_group_by.index(name)]
+            return [field_name for field_name, _ in value] if name == "operators" else list(value)
+    return sorted(set(predicates.equality).union(predicates.range))
+
+
+def shape_info(key: tuple, namespace: Any, hashes: List[str], predicates: IndexPredicates) -> Dict:
+    """The description of one result shape (without drill-down data), as built by finalize()"""
+    info = {
+        "field_names": group_field_names(key, predicates),
+        "namespace": namespace,
+        "hashes": hashes
+    }
+    if _group_by != DEFAULT_GROUP_BY:
+        info["group"] = group_labels(key)
+    return info
+
 
 def extract_match_shape_and_hash(batch: Dict) -> Tuple[str, tuple, str]:
-    """Extract the shape of the $match query and namespace"""
-    pipeline = batch.get("key", {}).get("queryShape", {}).get("pipeline", [])
+    """Extract the grouping key and namespace of an entry (see extract_match_shape)"""
+    return extract_match_shape(batch)[:3]
+
+
+def extract_match_shape(batch: Dict) -> Tuple[str, tuple, str, tuple]:
+    """Extract the grouping key, namespace and index predicates of an entry.
+
+    The key is group_key() of the query shape (by default its sorted
+    filter field names); the predicates are `(field operators, sort, has $or)` for
+    efficiency.IndexPredicates. Everything derived from the query shape is
+    cached per queryShapeHash, since the same shape recurs across clients,
+    hosts and time windows.
+    """
     original_hash = batch.get("queryShapeHash", "")
-    namespace = batch.get("key", {}).get("queryShape", {}).get("cmdNs", "")
-    
-    field_names = []
-    for stage in pipeline:
-        if "$match" in stage:
-            # Get all field names recursively
-            field_names = get_field_names(stage["$match"])
-            # Sort field names for consistent identification
-            field_names.sort()
-            break
-    
-    return original_hash, tuple(field_names), namespace  # Use tuple for hashability
+    if original_hash:
+        cached = _shape_cache.get(original_hash)
+        if cached is not None:
+            return original_hash, cached[0], cached[1], cached[2]
+
+    query_shape = batch.get("key", {}).get("queryShape", {})
+    namespace = query_shape.get("cmdNs", "")
+    description = describe_query_shape(query_shape)
+    key = group_key(description)
+    if original_hash:
+        _shape_cache.put(original_hash, (key, namespace, description.predicates))
+    return original_hash, key, namespace, description.predicates
 
 
 def get_field_names(obj: Dict, prefix="") -> List[str]:
-    """Recursively get all field names in a dictionary"""
-    field_names = []
-    if isinstance(obj, dict):
-        for key, value in obj.items():
+    """Get all field names in a $match expression, in document order (see get_field_operators)"""
+    return [field_name for field_name, _ in get_field_operators(obj, prefix)]
+
+
+def get_field_operators(obj: Dict, prefix="") -> List[Tuple[str, Tuple[str, ...]]]:
+    """Get the field names of a $match expression with the operators applied to each.
+
+    Walks the expression with an explicit stack (no recursion or per-level
+    lists), descending into $and/$or/$nor and nested fields. Fields are
+    returned in document order. The operators are the keys of the field's
+    value as they are; callers skip any key not starting with `$`.
+    """
+    field_operators = []
+    # Each frame is (node, prefix, key); key is None unless node is the value of a dict member
+    stack = [(obj, prefix, None)]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        node, node_prefix, key = pop()
+        if key is not None:
             # Skip operators (keys starting with $)
             if key.startswith("$"):
                 # If it's a logical operator, process its contents
-                if key in ["$and", "$or", "$nor"]:
-                    for item in value:
-                        field_names.extend(get_field_names(item, prefix))
+                if key in LOGICAL_OPERATORS and isinstance(node, list):
+                    for item in reversed(node):
+                        push((item, node_prefix, None))
                 continue
-                
-            new_prefix = f"{prefix}.{key}" if prefix else key
-            # If value is a dict and contains operators, add the field name
-            if isinstance(value, dict) and any(k.startswith("$") for k in value.keys()):
-                field_names.append(new_prefix)
-            
-            # Continue recursion
-            field_names.extend(get_field_names(value, new_prefix))
-    elif isinstance(obj, list):
-        for item in obj:
-            field_names.extend(get_field_names(item, prefix))
-            
-    return field_names
-
-def analyze_metrics(data: Dict) -> tuple:
-    """Analyze metrics from MongoDB aggregation data"""
-    # Group hashes by field names (shape)
-    shape_to_hashes = defaultdict(list)
-    hash_to_metrics = defaultdict(list)
-    hash_to_namespace = {}  # Store namespace for each hash
-    original_data = {}  # Store original data for drill-down
-    
-    for batch in data.get("cursor", {}).get("firstBatch", []):
-        query_shape_hash, field_names, namespace = extract_match_shape_and_hash(batch)
-        
-        if query_shape_hash and "metrics" in batch:
-            shape_to_hashes[field_names].append(query_shape_hash)
-            hash_to_metrics[query_shape_hash].append(batch["metrics"])
-            hash_to_namespace[query_shape_hash] = namespace
-            
-            # Store original data for drill-down
-            if query_shape_hash not in original_data:
-                original_data[query_shape_hash] = {
-                    "query_shape": batch.get("key", {}).get("queryShape", {}),
-                    "metrics": [],
-                    "namespace": namespace
-                }
-            original_data[query_shape_hash]["metrics"].append(batch["metrics"])
-    
-    # Assign shape IDs
-    shapes = {}
-    shape_id_counter = 1
-    
-    for field_names in shape_to_hashes.keys():
-        shapes[shape_id_counter] = {
-            "field_names": list(field_names),
-            "hashes": shape_to_hashes[field_names],
-            "original_data": {hash_val: original_data[hash_val] for hash_val in shape_to_hashes[field_names]}
-        }
-        shape_id_counter += 1
-    
-    # Calculate statistics for each shape
-    results = {}
-    for shape_id, shape_info in shapes.items():
-        # Initialize metrics containers
-        shape_results = {
-            "shapes_count": 0,
+
+            new_prefix = f"{node_prefix}.{key}" if node_prefix else key
+            if isinstance(node, dict):
+                # If value contains operators, add the field name with the value's keys
+                for value_key in node:
+                    if value_key.startswith("$"):
+                        field_operators.append((new_prefix, tuple(node)))
+                        break
+            push((node, new_prefix, None))
+        elif isinstance(node, dict):
+            for item in reversed(node.items()):
+                push((item[1], node_prefix, item[0]))
+        elif isinstance(node, list):
+            for item in reversed(node):
+                push((item, node_prefix, None))
+
+    return field_operators
+
+def iter_entries(data: Union[Dict, Iterable[Dict]]) -> Iterator[Dict]:
+    """Iterate over queryStats entries from a parsed reply or an entry iterable"""
+    if isinstance(data, dict):
+        cursor = data.get("cursor", {})
+        return iter(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    return iter(data)
+
+
+def entry_key(batch: Dict) -> str:
+    """Canonical identity of an entry's `key` apart from its query shape.
+
+    Entries sharing a queryShapeHash differ by client, read concern, etc.;
+    together with the hash this identifies one cumulative queryStats entry.
+    """
+    key = batch.get("key", {})
+    return json.dumps({name: value for name, value in key.items() if name != "queryShape"},
+                      sort_keys=True, separators=(",", ":"))
+
+
+def entry_counters(metrics: Dict) -> Tuple:
+    """The totals one entry contributes to a ShapeAccumulator, as a compact tuple.
+
+    `(execCount, totalExecMicros sum or None, docsReturned, keysExamined,
+    docsExamined)`; kept for tracked entries in place of their metrics so a
+    later reading can be applied as a delta (like delta._counters).
+    """
+    total_exec = metrics.get("totalExecMicros")
+    docs_returned = metrics.get("docsReturned")
+    keys_examined = metrics.get("keysExamined")
+    docs_examined = metrics.get("docsExamined")
+    return (
+        metrics.get("execCount", 0),
+        total_exec["sum"] if total_exec and "sum" in total_exec else None,
+        docs_returned["sum"] if docs_returned and "sum" in docs_returned else 0,
+        keys_examined["sum"] if keys_examined and "sum" in keys_examined else 0,
+        docs_examined["sum"] if docs_examined and "sum" in docs_examined else 0,
+    )
+
+
+class ShapeAccumulator:
+    """Running totals for one query shape, updated one entry at a time"""
+    __slots__ = (
+        "namespace",
+        "hashes",
+        "entry_count",
+        "exec_count",
+        "avg_exec_millis_sum",
+        "avg_exec_millis_count",
+        "total_exec_micros",
+        "docs_returned",
+        "keys_examined",
+        "docs_examined",
+        "predicates",
+    )
+
+    def __init__(self, namespace: Any = ""):
+        self.namespace = namespace
+        self.hashes: Dict[str, None] = {}  # Insertion-ordered set of hashes
+        self.entry_count = 0
+        self.exec_count = 0
+        self.avg_exec_millis_sum = 0.0  # Sum of per-entry averages (mean of means)
+        self.avg_exec_millis_count = 0
+        self.total_exec_micros = 0
+        self.docs_returned = 0
+        self.keys_examined = 0
+        self.docs_examined = 0
+        self.predicates = IndexPredicates()
+
+    def add(self, metrics: Dict):
+        """Fold one entry's metrics into the running totals"""
+        self.entry_count += 1
+        exec_count = metrics.get("execCount", 0)
+        self.exec_count += exec_count
+
+        total_exec = metrics.get("totalExecMicros")
+        if total_exec and "sum" in total_exec:
+            total_exec_sum = total_exec["sum"]
+            self.total_exec_micros += total_exec_sum
+            if exec_count > 0:
+                self.avg_exec_millis_sum += (total_exec_sum / exec_count) / 1000.0
+                self.avg_exec_millis_count += 1
+
+        docs_returned = metrics.get("docsReturned")
+        if docs_returned and "sum" in docs_returned:
+            self.docs_returned += docs_returned["sum"]
+        keys_examined = metrics.get("keysExamined")
+        if keys_examined and "sum" in keys_examined:
+            self.keys_examined += keys_examined["sum"]
+        docs_examined = metrics.get("docsExamined")
+        if docs_examined and "sum" in docs_examined:
+            self.docs_examined += docs_examined["sum"]
+
+    def remove(self, counters: Tuple):
+        """Take back the contribution of an entry previously passed to add(), given as its entry_counters()"""
+        exec_count, total_exec_sum, docs_returned, keys_examined, docs_examined = counters
+        self.entry_count -= 1
+        self.exec_count -= exec_count
+        if total_exec_sum is not None:
+            self.total_exec_micros -= total_exec_sum
+            if exec_count > 0:
+                self.avg_exec_millis_sum -= (total_exec_sum / exec_count) / 1000.0
+                self.avg_exec_millis_count -= 1
+        self.docs_returned -= docs_returned
+        self.keys_examined -= keys_examined
+        self.docs_examined -= docs_examined
+
+    def replace(self, old_counters: Tuple, new_metrics: Dict):
+        """Apply the delta between two cumulative readings of the same entry"""
+        self.remove(old_counters)
+        self.add(new_metrics)
+
+    def merge(self, other: "ShapeAccumulator"):
+        """Fold another accumulator for the same shape into this one"""
+        if not self.hashes and not self.namespace:
+            self.namespace = other.namespace
+        self.hashes.update(other.hashes)
+        self.entry_count += other.entry_count
+        self.exec_count += other.exec_count
+        self.avg_exec_millis_sum += other.avg_exec_millis_sum
+        self.avg_exec_millis_count += other.avg_exec_millis_count
+        self.total_exec_micros += other.total_exec_micros
+        self.docs_returned += other.docs_returned
+        self.keys_examined += other.keys_examined
+        self.docs_examined += other.docs_examined
+        self.predicates.merge(other.predicates)
+
+    def to_result(self) -> Dict:
+        """Build the per-shape statistics dict consumed by the output modules"""
+        count = self.entry_count
+        return {
+            "shapes_count": count,
             "execCount": {
-                "total": 0
+                "total": self.exec_count
             },
             "avgExecMillis": {
-                "values": [],
-                "avg": 0
+                "avg": self.avg_exec_millis_sum / self.avg_exec_millis_count if self.avg_exec_millis_count else 0
             },
             "totalExecMillis": {
-                "avg": 0
+                "avg": self.total_exec_micros / 1000.0 / count if count else 0,
+                "total": self.total_exec_micros / 1000.0
             },
             "docsReturned": {
-                "avg": 0,
-                "total": 0
+                "avg": self.docs_returned / count if count else 0,
+                "total": self.docs_returned
             },
             "keysExamined": {
-                "avg": 0,
-                "total": 0
+                "avg": self.keys_examined / count if count else 0,
+                "total": self.keys_examined
             },
             "docsExamined": {
-                "avg": 0,
-                "total": 0
-            }
+                "avg": self.docs_examined / count if count else 0,
+                "total": self.docs_examined
+            },
+            "efficiency": dict(
+                efficiency_scores(self.total_exec_micros, self.docs_returned, self.keys_examined,
+                                  self.docs_examined),
+                indexCandidate=self.predicates.candidate()
+            )
         }
-        
-        # Process each hash separately to calculate per-hash average execution time
-        for hash_val in shape_info["hashes"]:
-            metrics_list = hash_to_metrics[hash_val]
-            shape_results["shapes_count"] += len(metrics_list)
-            
-            # Calculate average execution time for this hash
-            for metric in metrics_list:
-                # Execution count
-                exec_count = metric.get("execCount", 0)
-                shape_results["execCount"]["total"] += exec_count
-                
-                # Calculate avg exec time for this hash (totalExecMicros.sum / execCount)
-                if "totalExecMicros" in metric and "sum" in metric["totalExecMicros"] and exec_count > 0:
-                    total_exec_sum = metric["totalExecMicros"]["sum"]
-                    avg_exec_time = (total_exec_sum / exec_count) / 1000.0  # Convert to ms
-                    shape_results["avgExecMillis"]["values"].append(avg_exec_time)
-                
-                # Total execution time in ms
-                if "totalExecMicros" in metric and "sum" in metric["totalExecMicros"]:
-                    total_exec_ms = metric["totalExecMicros"]["sum"] / 1000.0
-                    shape_results["totalExecMillis"]["avg"] += total_exec_ms
-                
-                # Docs returned
-                if "docsReturned" in metric and "sum" in metric["docsReturned"]:
-                    docs_sum = metric["docsReturned"]["sum"]
-                    shape_results["docsReturned"]["total"] += docs_sum
-                
-                # Keys examined
-                if "keysExamined" in metric and "sum" in metric["keysExamined"]:
-                    keys_sum = metric["keysExamined"]["sum"]
-                    shape_results["keysExamined"]["total"] += keys_sum
-                
-                # Docs examined
-                if "docsExamined" in metric and "sum" in metric["docsExamined"]:
-                    docs_exam_sum = metric["docsExamined"]["sum"]
-                    shape_results["docsExamined"]["total"] += docs_exam_sum
-        
-        # Calculate the average of averages for exec time
-        if shape_results["avgExecMillis"]["values"]:
-            shape_results["avgExecMillis"]["avg"] = statistics.mean(shape_results["avgExecMillis"]["values"])
-        
-        # Calculate average for total execution time
-        metric_count = shape_results["shapes_count"]
-        if metric_count > 0:
-            shape_results["totalExecMillis"]["avg"] /= metric_count
-            shape_results["docsReturned"]["avg"] = shape_results["docsReturned"]["total"] / metric_count
-            shape_results["keysExamined"]["avg"] = shape_results["keysExamined"]["total"] / metric_count
-            shape_results["docsExamined"]["avg"] = shape_results["docsExamined"]["total"] / metric_count
-        
-        results[shape_id] = shape_results
-    
-    return results, shapes
\ No newline at end of file
+
+
+class MetricsAggregator:
+    """Single-pass aggregation of queryStats entries grouped by shape key (see configure_grouping).
+
+    Per-hash drill-down data (query shape and per-entry metrics) is only
+    retained when `detail` is set; otherwise memory is bounded by the number
+    of distinct shapes and hashes.
+
+    With `track_entries`, each entry is identified by its queryShapeHash and
+    `key`, and a later reading of the same entry (e.g. from a newer dump)
+    replaces the earlier one: since queryStats counters are cumulative, only
+    the difference is applied to the aggregates.
+    """
+
+    def __init__(self, detail: bool = True, track_entries: bool = False):
+        self.detail = detail
+        self.shapes: Dict[tuple, ShapeAccumulator] = {}
+        self.original_data: Dict[str, Dict] = {}
+        # (queryShapeHash, key) -> (entry_counters of the last reading, position in original_data metrics)
+        self.entries: Optional[Dict[Tuple[str, str], Tuple[Tuple, int]]] = {} if track_entries else None
+
+    def add(self, batch: Dict):
+        """Fold a single queryStats entry into the aggregates"""
+        metrics = batch.get("metrics")
+        if metrics is None:
+            return
+        if PROFILER.enabled:
+            start = time.perf_counter()
+            query_shape_hash, shape_key, namespace, predicates = extract_match_shape(batch)
+            PROFILER.add_time("aggregate.extract_shape", time.perf_counter() - start)
+        else:
+            query_shape_hash, shape_key, namespace, predicates = extract_match_shape(batch)
+        if not query_shape_hash:
+            return
+
+        accumulator = self.shapes.get(shape_key)
+        if accumulator is None:
+            accumulator = self.shapes[shape_key] = ShapeAccumulator(namespace)
+        if query_shape_hash not in accumulator.hashes:
+            accumulator.hashes[query_shape_hash] = None
+            accumulator.predicates.add(*predicates)
+
+        entry_id = None
+        if self.entries is not None:
+            entry_id = (query_shape_hash, entry_key(batch))
+            previous = self.entries.get(entry_id)
+            if previous is not None:
+                previous_counters, position = previous
+                accumulator.replace(previous_counters, metrics)
+                if self.detail:
+                    self.original_data[query_shape_hash]["metrics"][position] = metrics
+                self.entries[entry_id] = (entry_counters(metrics), position)
+                return
+
+        accumulator.add(metrics)
+
+        position = -1
+        if self.detail:
+            hash_data = self.original_data.get(query_shape_hash)
+            if hash_data is None:
+                hash_data = self.original_data[query_shape_hash] = {
+                    "query_shape": batch.get("key", {}).get("queryShape", {}),
+                    "metrics": [],
+                    "namespace": namespace
+                }
+            position = len(hash_data["metrics"])
+            hash_data["metrics"].append(metrics)
+
+        if entry_id is not None:
+            self.entries[entry_id] = (entry_counters(metrics), position)
+
+    def add_all(self, entries: Iterable[Dict]):
+        """Fold every entry of an iterable into the aggregates"""
+        if PROFILER.enabled:
+            self._add_all_profiled(entries)
+            return
+        add = self.add
+        for batch in entries:
+            add(batch)
+
+    def _add_all_profiled(self, entries: Iterable[Dict]):
+        """add_all, splitting the time spent producing entries (parsing) from aggregating them"""
+        add = self.add
+        clock = time.perf_counter
+        iterator = iter(entries)
+        parse = aggregate = 0.0
+        count = 0
+        try:
+            while True:
+                start = clock()
+                batch = next(iterator, None)
+                produced = clock()
+                parse += produced - start
+                if batch is None:
+                    break
+                add(batch)
+                aggregate += clock() - produced
+                count += 1
+        finally:
+            PROFILER.add_time("parse", parse)
+            PROFILER.add_time("aggregate", aggregate)
+            PROFILER.count("entries", count)
+
+    def merge(self, other: "MetricsAggregator"):
+        """Fold a partial aggregate (e.g. from another file or worker) into this one.
+
+        Merging is associative, so partials can be combined in any grouping;
+        shape IDs follow the order in which shapes were first merged.
+        """
+        for shape_key, other_accumulator in other.shapes.items():
+            accumulator = self.shapes.get(shape_key)
+            if accumulator is None:
+                accumulator = self.shapes[shape_key] = ShapeAccumulator(other_accumulator.namespace)
+            accumulator.merge(other_accumulator)
+
+        if self.detail:
+            for hash_val, other_data in other.original_data.items():
+                hash_data = self.original_data.get(hash_val)
+                if hash_data is None:
+                    self.original_data[hash_val] = {
+                        "query_shape": other_data["query_shape"],
+                        "metrics": list(other_data["metrics"]),
+                        "namespace": other_data["namespace"]
+                    }
+                else:
+                    hash_data["metrics"].extend(other_data["metrics"])
+
+    @PROFILER.timed("finalize")
+    def finalize(self, limit: Optional[int] = None) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+        """Assign shape IDs and build the `(results, shapes)` pair.
+
+        With `limit`, only the shapes with the highest total execution time
+        are built (e.g. for partial results while ingestion continues);
+        shape IDs are the same as in the full result.
+        """
+        selected = None
+        if limit is not None and limit < len(self.shapes):
+            selected = {id(accumulator) for accumulator in heapq.nlargest(
+                limit, self.shapes.values(), key=lambda accumulator: accumulator.total_exec_micros)}
+        results = {}
+        shapes = {}
+        for shape_id, (shape_key, accumulator) in enumerate(self.shapes.items(), start=1):
+            if selected is not None and id(accumulator) not in selected:
+                continue
+            hashes = list(accumulator.hashes)
+            info = shape_info(shape_key, accumulator.namespace, hashes, accumulator.predicates)
+            if self.detail:
+                info["original_data"] = {hash_val: self.original_data[hash_val] for hash_val in hashes}
+            shapes[shape_id] = info
+            results[shape_id] = accumulator.to_result()
+        PROFILER.set("shapes", len(results))
+        PROFILER.set("hashes", sum(len(shape["hashes"]) for shape in shapes.values()))
+        return results, shapes
+
+
+def analyze_metrics(data: Union[Dict, Iterable[Dict]], detail: bool = True) -> tuple:
+    """Analyze metrics from MongoDB aggregation data.
+
+    `data` is either a parsed `$queryStats` reply or an iterable of entries
+    (see ingest.iter_batch_entries); entries are folded into per-shape
+    accumulators as they are consumed. Pass `detail=False` to skip the
+    per-hash drill-down data when only the summary is needed.
+    """
+    aggregator = MetricsAggregator(detail=detail)
+    aggregator.add_all(iter_entries(data))
+    return aggregator.finalize()
+
+
+def aggregate_file(path: str, detail: bool = True,
+                   factory: Optional[Callable[[], MetricsAggregator]] = None) -> MetricsAggregator:
+    """Stream one file into a partial aggregate (runs inside pool workers).
+
+    `factory` creates the aggregator (default: a MetricsAggregator with
+    `detail`); it must be picklable to be used in a process pool.
+    """
+    aggregator = factory() if factory is not None else MetricsAggregator(detail=detail)
+    aggregator.add_all(iter_batch_entries(path))
+    return aggregator
+
+
+def _init_worker(cache_size: int, group_by: Tuple[str, ...], profile: bool):
+    """Pool initializer: configure the worker's shape cache and grouping, and enable profiling like the parent"""
+    configure_grouping(group_by)
+    configure_shape_cache(cache_size)
+    if profile:
+        PROFILER.enable()
+
+
+def _aggregate_file_worker(path: str, detail: bool, factory: Optional[Callable[[], MetricsAggregator]]
+                           ) -> Tuple[MetricsAggregator, int, int, Optional[Dict]]:
+    """Pool entry point: aggregate one file and report this task's cache lookups and profile"""
+    hits, misses = _shape_cache.hits, _shape_cache.misses
+    PROFILER.reset()
+    aggregator = aggregate_file(path, detail, factory)
+    profile = PROFILER.snapshot() if PROFILER.enabled else None
+    return aggregator, _shape_cache.hits - hits, _shape_cache.misses - misses, profile
+
+
+def iter_file_aggregates(paths: Sequence[str], detail: bool = True, workers: Optional[int] = None,
+                         factory: Optional[Callable[[], MetricsAggregator]] = None
+                         ) -> Iterator[Tuple[str, MetricsAggregator]]:
+    """Yield `(path, partial aggregate)` for each file, in input order.
+
+    Files are parsed and aggregated in a process pool of `workers` processes
+    (default: one per CPU), or in this process when there is one worker.
+    """
+    workers = min(len(paths), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        for path in paths:
+            yield path, aggregate_file(path, detail, factory)
+        return
+
+    PROFILER.set("workers", workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_shape_cache.maxsize, _group_by, PROFILER.enabled)) as executor:
+        results = executor.map(_aggregate_file_worker, paths, [detail] * len(paths), [factory] * len(paths))
+        for path, (partial, hits, misses, profile) in zip(paths, results):
+            _shape_cache.record(hits, misses)
+            if profile:
+                PROFILER.merge(profile)
+            yield path, partial
+
+
+def analyze_files(paths: Sequence[str], detail: bool = True, workers: Optional[int] = None,
+                  factory: Optional[Callable[[], MetricsAggregator]] = None) -> tuple:
+    """Analyze several queryStats dumps (e.g. one per mongod/mongos) as one result.
+
+    Partial aggregates from iter_file_aggregates are merged in input order
+    so shape IDs are deterministic. `factory` selects another aggregator
+    (e.g. heavy_hitters.TopKAggregator), as in aggregate_file.
+    """
+    total = factory() if factory is not None else MetricsAggregator(detail=detail)
+    for _, partial in iter_file_aggregates(paths, detail, workers, factory):
+        with PROFILER.phase("merge"):
+            total.merge(partial)
+    return total.finalize()
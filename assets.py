@@ -0,0 +1,170 @@
+"""
+MongoDB Query Metrics Analyzer - Static Assets Module
+
+The JavaScript and CSS behind the web UI, vendored under static/vendor so
+the UI works without access to public CDNs. Vendored paths mirror the CDN
+layout and carry the library version, so they never change content and
+are served with long-lived cache headers, precompressed with gzip (and
+brotli, when the brotli package is installed). Downloads are checked
+against the publishers' Subresource Integrity digests pinned in
+static/vendor-integrity.json before anything is written; assets that are
+not vendored are loaded from their CDN URLs.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import urllib.request
+from typing import Dict, List, Optional
+
+from flask import Response, request, send_from_directory, url_for
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+INTEGRITY_FILE = os.path.join(STATIC_DIR, "vendor-integrity.json")  # Vendored path -> "sha256-<base64>"
+VENDOR_MAX_AGE = 365 * 24 * 3600  # Versioned paths, so browsers may keep them for a year
+COMPRESSIBLE_EXTENSIONS = (".js", ".css")
+
+# Vendored path -> pinned CDN URL
+VENDOR_ASSETS: Dict[str, str] = {
+    "jquery/3.6.0/jquery.min.js": "https://code.jquery.com/jquery-3.6.0.min.js",
+    "datatables/1.11.5/js/jquery.dataTables.min.js":
+        "https://cdn.datatables.net/1.11.5/js/jquery.dataTables.min.js",
+    "datatables/1.11.5/css/jquery.dataTables.min.css":
+        "https://cdn.datatables.net/1.11.5/css/jquery.dataTables.min.css",
+    "datatables/scroller/2.0.5/js/dataTables.scroller.min.js":
+        "https://cdn.datatables.net/scroller/2.0.5/js/dataTables.scroller.min.js",
+    "datatables/scroller/2.0.5/css/scroller.dataTables.min.css":
+        "https://cdn.datatables.net/scroller/2.0.5/css/scroller.dataTables.min.css",
+    "json-viewer/1.4.0/jquery.json-viewer.js":
+        "https://cdn.jsdelivr.net/npm/jquery.json-viewer@1.4.0/json-viewer/jquery.json-viewer.js",
+    "json-viewer/1.4.0/jquery.json-viewer.css":
+        "https://cdn.jsdelivr.net/npm/jquery.json-viewer@1.4.0/json-viewer/jquery.json-viewer.css",
+}
+# Sort arrows referenced by the DataTables stylesheet (relative to its css directory)
+VENDOR_ASSETS.update({
+    f"datatables/1.11.5/images/{name}.png": f"https://cdn.datatables.net/1.11.5/images/{name}.png"
+    for name in ("sort_both", "sort_asc", "sort_desc", "sort_asc_disabled", "sort_desc_disabled")
+})
+
+
+def integrity(content: bytes) -> str:
+    """Subresource Integrity string of `content`, e.g. `sha256-47DEQpj8...`"""
+    return "sha256-" + base64.b64encode(hashlib.sha256(content).digest()).decode("ascii")
+
+
+def load_integrity(path: str = INTEGRITY_FILE) -> Dict[str, str]:
+    """Pinned digests of the vendored assets ({} when none are pinned)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def fetch_assets(directory: str = VENDOR_DIR, overwrite: bool = False,
+                 digests: Optional[Dict[str, str]] = None) -> List[str]:
+    """Download the pinned assets into `directory` and precompress them.
+
+    Run once on a machine with internet access; the directory can then be
+    copied to hosts without it. Each download must match its digest in
+    `digests` (by default INTEGRITY_FILE) or ValueError is raised before it
+    is written. Assets without a digest are never downloaded; ValueError
+    lists them once the others are written. Returns the paths written.
+    """
+    if digests is None:
+        digests = load_integrity()
+    written = []
+    unpinned = []
+    for path, url in VENDOR_ASSETS.items():
+        target = os.path.join(directory, *path.split("/"))
+        if os.path.exists(target) and not overwrite:
+            continue
+        expected = digests.get(path)
+        if expected is None:
+            unpinned.append(path)
+            continue
+        with urllib.request.urlopen(url, timeout=30) as response:
+            content = response.read()
+        if integrity(content) != expected:
+            raise ValueError(f"{url} does not match its pinned digest {expected}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(content)
+        written.append(target)
+        written.extend(precompress(target))
+    if unpinned:
+        raise ValueError(f"No pinned digest in {os.path.basename(INTEGRITY_FILE)} for {', '.join(unpinned)} "
+                         f"(add the publisher's sha256 SRI hash); {len(written)} files written")
+    return written
+
+
+def precompress(path: str) -> List[str]:
+    """Write `path.gz` (and `path.br`) next to a text asset; returns the paths written"""
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return []
+    with open(path, "rb") as f:
+        content = f.read()
+    written = [path + ".gz"]
+    # mtime=0 keeps the output identical across runs
+    with open(written[0], "wb") as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return written
+    written.append(path + ".br")
+    with open(written[1], "wb") as f:
+        f.write(brotli.compress(content, quality=11))
+    return written
+
+
+class VendoredAssets:
+    """The vendored files present at startup, and the URLs pages load them from"""
+
+    def __init__(self, directory: str = VENDOR_DIR):
+        self.directory = directory
+        self.available = set()
+        if os.path.isdir(directory):
+            for root, _, files in os.walk(directory):
+                relative_root = os.path.relpath(root, directory).replace(os.sep, "/")
+                for name in files:
+                    self.available.add(name if relative_root == "." else f"{relative_root}/{name}")
+
+    def url(self, path: str) -> str:
+        """URL of a VENDOR_ASSETS path: vendored when present, the CDN otherwise"""
+        if path in self.available:
+            return url_for("vendor_asset", filename=path)
+        return VENDOR_ASSETS[path]
+
+    def response(self, filename: str) -> Response:
+        """Serve a vendored file, precompressed when the client accepts it"""
+        encoding = self._encoding(filename)
+        response = send_from_directory(
+            self.directory, filename + {"br": ".br", "gzip": ".gz"}.get(encoding, ""),
+            mimetype=_mimetype(filename), max_age=VENDOR_MAX_AGE, conditional=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def _encoding(self, filename: str) -> Optional[str]:
+        """Best precompressed variant of `filename` the client accepts"""
+        accepted = request.accept_encodings
+        if accepted["br"] and filename + ".br" in self.available:
+            return "br"
+        if accepted["gzip"] and filename + ".gz" in self.available:
+            return "gzip"
+        return None
+
+
+def _mimetype(filename: str) -> Optional[str]:
+    """Content type of the uncompressed file (send_file would guess from the .gz/.br name)"""
+    if filename.endswith(".js"):
+        return "application/javascript"
+    if filename.endswith(".css"):
+        return "text/css"
+    return None
@@ -0,0 +1,167 @@
+"""
+MongoDB Query Metrics Analyzer - Background Analysis Module
+
+Analyzes dump files on a worker thread so the web UI can be served right
+away. Progress is tracked for the /api/progress endpoint, and the top
+shapes found so far are published at regular intervals until the full
+results are ready.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Sequence
+
+from analyzer import MetricsAggregator, iter_file_aggregates
+from ingest import iter_stream_entries
+
+PUBLISH_INTERVAL = 2.0  # Seconds between publications of partial results
+PARTIAL_TOP_N = 100  # Shapes (by total execution time) included in partial results
+PROGRESS_EVERY = 1000  # Entries between progress updates
+
+
+class AnalysisProgress:
+    """Progress of a running analysis, updated by its thread and read by the web server"""
+
+    def __init__(self, bytes_total: int = 0, files_total: int = 0):
+        self._lock = threading.Lock()
+        self.state = "running"  # running, done or error
+        self.entries = 0
+        self.bytes_read = 0
+        self.bytes_total = bytes_total
+        self.files_done = 0
+        self.files_total = files_total
+        self.shapes = 0
+        self.partial_top: Optional[int] = None  # Shapes shown while results are partial
+        self.version = 0  # Incremented on every publication of results
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.finished: Optional[float] = None
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def published(self, shapes: int, partial_top: Optional[int]):
+        """Record that new (partial or final) results are being served"""
+        with self._lock:
+            self.shapes = shapes
+            self.partial_top = partial_top
+            self.version += 1
+
+    def finish(self, error: Optional[str] = None):
+        with self._lock:
+            self.state = "error" if error else "done"
+            self.error = error
+            self.finished = time.time()
+            if not error:
+                self.bytes_read = self.bytes_total
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            elapsed = (self.finished or time.time()) - self.started
+            eta = None
+            if self.state == "running" and self.bytes_read and self.bytes_total:
+                eta = elapsed * (self.bytes_total - self.bytes_read) / self.bytes_read
+            return {
+                "state": self.state,
+                "entriesProcessed": self.entries,
+                "bytesRead": self.bytes_read,
+                "bytesTotal": self.bytes_total,
+                "percent": 100.0 * self.bytes_read / self.bytes_total if self.bytes_total else None,
+                "filesDone": self.files_done,
+                "filesTotal": self.files_total,
+                "shapes": self.shapes,
+                "partialTop": self.partial_top,
+                "version": self.version,
+                "elapsedSeconds": elapsed,
+                "etaSeconds": eta,
+                "entriesPerSecond": self.entries / elapsed if elapsed > 0 else 0.0,
+                "error": self.error,
+            }
+
+
+class BackgroundAnalysis(threading.Thread):
+    """Analyze `paths` on a daemon thread, calling `publish(results, shapes)` as results build up.
+
+    With one worker, entries are streamed here and the top `top` shapes
+    are published every `publish_interval` seconds; with several, files
+    are aggregated in a process pool (as analyze_files does) and partial
+    results are published as files complete. `on_complete` is called with
+    the full results after their final publication. `factory` selects
+    another aggregator, as in analyzer.aggregate_file.
+    """
+
+    def __init__(self, paths: Sequence[str], publish: Callable[[Dict, Dict], None], detail: bool = True,
+                 workers: Optional[int] = None, publish_interval: float = PUBLISH_INTERVAL,
+                 top: int = PARTIAL_TOP_N, on_complete: Optional[Callable[[Dict, Dict], None]] = None,
+                 factory: Optional[Callable[[], MetricsAggregator]] = None):
+        super().__init__(name="analysis", daemon=True)
+        self.paths = list(paths)
+        self.publish = publish
+        self.detail = detail
+        self.workers = min(len(self.paths), workers or os.cpu_count() or 1)
+        self.publish_interval = publish_interval
+        self.top = top
+        self.on_complete = on_complete
+        self.factory = factory
+        self.progress = AnalysisProgress(sum(os.path.getsize(path) for path in self.paths), len(self.paths))
+        self._next_publish = 0.0
+
+    def _publish(self, aggregator: MetricsAggregator, final: bool = False) -> tuple:
+        partial_top = None if final or len(aggregator.shapes) <= self.top else self.top
+        results, shapes = aggregator.finalize(partial_top)
+        self.publish(results, shapes)
+        self.progress.published(len(aggregator.shapes), partial_top)
+        self._next_publish = time.monotonic() + self.publish_interval
+        return results, shapes
+
+    def _iter_entries(self, aggregator: MetricsAggregator) -> Iterator[Dict]:
+        """Stream every file's entries, reporting progress and publishing partial results in between"""
+        entries = 0
+        bytes_done = 0
+        for files_done, path in enumerate(self.paths, start=1):
+            with open(path, 'r', encoding='utf-8') as file:
+                for batch in iter_stream_entries(file):
+                    yield batch
+                    entries += 1
+                    if not entries % PROGRESS_EVERY:
+                        self.progress.update(entries=entries, bytes_read=bytes_done + file.buffer.tell())
+                        if time.monotonic() >= self._next_publish:
+                            self._publish(aggregator)
+            bytes_done += os.path.getsize(path)
+            self.progress.update(entries=entries, bytes_read=bytes_done, files_done=files_done)
+
+    def _new_aggregator(self) -> MetricsAggregator:
+        return self.factory() if self.factory is not None else MetricsAggregator(detail=self.detail)
+
+    def _run_streaming(self) -> MetricsAggregator:
+        aggregator = self._new_aggregator()
+        aggregator.add_all(self._iter_entries(aggregator))
+        return aggregator
+
+    def _run_pool(self) -> MetricsAggregator:
+        total = self._new_aggregator()
+        entries = 0
+        bytes_done = 0
+        files = iter_file_aggregates(self.paths, self.detail, self.workers, self.factory)
+        for files_done, (path, partial) in enumerate(files, start=1):
+            total.merge(partial)
+            entries += sum(accumulator.entry_count for accumulator in partial.shapes.values())
+            bytes_done += os.path.getsize(path)
+            self.progress.update(entries=entries, bytes_read=bytes_done, files_done=files_done)
+            if files_done < len(self.paths) and time.monotonic() >= self._next_publish:
+                self._publish(total)
+        return total
+
+    def run(self):
+        self._next_publish = time.monotonic() + self.publish_interval
+        try:
+            aggregator = self._run_pool() if self.workers > 1 else self._run_streaming()
+            results, shapes = self._publish(aggregator, final=True)
+        except Exception as e:
+            self.progress.finish(str(e))
+            return
+        self.progress.finish()
+        if self.on_complete is not None:
+            self.on_complete(results, shapes)
@@ -0,0 +1,3 @@
+"""
+MongoDB Query Metrics Analyzer - Benchmarks
+"""
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+MongoDB Query Metrics Analyzer - Aggregation Benchmark
+
+Compares the original three-stage analyze_metrics with the single-pass
+accumulator engine (and the NumPy engine, when installed) on synthetic
+input. Run from the repository root:
+
+    python -m benchmarks.bench_aggregation --entries 500000
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, Dict
+
+from analyzer import analyze_metrics, extract_match_shape_and_hash, reset_caches
+from benchmarks.synthetic import generate_reply
+
+
+def legacy_analyze_metrics(data: Dict) -> tuple:
+    """The pre-accumulator implementation, kept as the benchmark baseline"""
+    shape_to_hashes = defaultdict(list)
+    hash_to_metrics = defaultdict(list)
+    original_data = {}
+
+    for batch in data.get("cursor", {}).get("firstBatch", []):
+        query_shape_hash, field_names, namespace = extract_match_shape_and_hash(batch)
+        if query_shape_hash and "metrics" in batch:
+            shape_to_hashes[field_names].append(query_shape_hash)
+            hash_to_metrics[query_shape_hash].append(batch["metrics"])
+            if query_shape_hash not in original_data:
+                original_data[query_shape_hash] = {
+                    "query_shape": batch.get("key", {}).get("queryShape", {}),
+                    "metrics": [],
+                    "namespace": namespace
+                }
+            original_data[query_shape_hash]["metrics"].append(batch["metrics"])
+
+    shapes = {}
+    for shape_id, field_names in enumerate(shape_to_hashes.keys(), start=1):
+        shapes[shape_id] = {
+            "field_names": list(field_names),
+            "hashes": shape_to_hashes[field_names],
+            "original_data": {hash_val: original_data[hash_val] for hash_val in shape_to_hashes[field_names]}
+        }
+
+    results = {}
+    for shape_id, shape_info in shapes.items():
+        values = []
+        exec_total = 0
+        total_exec_ms = 0.0
+        sums = {"docsReturned": 0, "keysExamined": 0, "docsExamined": 0}
+        count = 0
+        for hash_val in shape_info["hashes"]:
+            for metric in hash_to_metrics[hash_val]:
+                count += 1
+                exec_count = metric.get("execCount", 0)
+                exec_total += exec_count
+                if "totalExecMicros" in metric and "sum" in metric["totalExecMicros"]:
+                    if exec_count > 0:
+                        values.append((metric["totalExecMicros"]["sum"] / exec_count) / 1000.0)
+                    total_exec_ms += metric["totalExecMicros"]["sum"] / 1000.0
+                for name in sums:
+                    if name in metric and "sum" in metric[name]:
+                        sums[name] += metric[name]["sum"]
+        results[shape_id] = {
+            "shapes_count": count,
+            "execCount": {"total": exec_total},
+            "avgExecMillis": {"values": values, "avg": statistics.mean(values) if values else 0},
+            "totalExecMillis": {"avg": total_exec_ms / count if count else 0},
+            **{name: {"total": total, "avg": total / count if count else 0} for name, total in sums.items()}
+        }
+    return results, shapes
+
+
+def measure(label: str, func: Callable[[], object], repeat: int) -> Dict:
+    """Time `func` and record the peak memory it allocates, starting each call with an empty shape cache"""
+    timings = []
+    for _ in range(repeat):
+        reset_caches()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    reset_caches()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"label": label, "seconds": min(timings), "peak_bytes": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark analyze_metrics implementations')
+    parser.add_argument('--entries', type=int, default=100000, help='Number of synthetic entries')
+    parser.add_argument('--hashes', type=int, default=5000, help='Number of distinct query shape hashes')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    data = generate_reply(entries=args.entries, hashes=args.hashes)
+    entries = data["cursor"]["firstBatch"]
+
+    runs = [
+        measure("legacy", lambda: legacy_analyze_metrics(data), args.repeat),
+        measure("accumulator (detail)", lambda: analyze_metrics(entries), args.repeat),
+        measure("accumulator (summary)", lambda: analyze_metrics(entries, detail=False), args.repeat),
+    ]
+    try:
+        from numpy_engine import analyze_metrics_numpy
+    except ImportError:
+        print("numpy not installed, skipping the NumPy engine")
+    else:
+        runs.append(measure("numpy (summary)", lambda: analyze_metrics_numpy(entries, detail=False), args.repeat))
+
+    baseline = runs[0]
+    print(f"{args.entries} entries, {args.hashes} hashes")
+    for run in runs:
+        print(f"{run['label']:<24} {run['seconds']:8.3f}s "
+              f"({baseline['seconds'] / run['seconds']:5.2f}x)  "
+              f"peak {run['peak_bytes'] / 1e6:8.1f} MB "
+              f"({baseline['peak_bytes'] / max(run['peak_bytes'], 1):5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+MongoDB Query Metrics Analyzer - Mock queryStats Server
+
+An in-process stand-in for a mongod/mongos that answers `$queryStats`
+through the cursor protocol (aggregate, getMore, killCursors) with
+synthetic entries and an optional delay per round trip. It can be passed
+anywhere mongo_source expects a client:
+
+    client = MockQueryStatsClient(list(generate_entries(100000)), latency=0.005)
+    results, shapes = analyze_metrics(iter_query_stats(client))
+"""
+import itertools
+import time
+from typing import Dict, List, Sequence
+
+
+class MockAdminDatabase:
+    """Answers the cursor commands issued against the `admin` database"""
+
+    def __init__(self, entries: Sequence[Dict], latency: float):
+        self.entries = entries
+        self.latency = latency
+        self.cursors: Dict[int, int] = {}  # cursor id -> position of its next entry
+        self.commands: List[str] = []
+        self._ids = itertools.count(1)
+
+    def _batch(self, cursor_id: int, position: int, batch_size: int, first: bool) -> Dict:
+        batch = list(self.entries[position:position + batch_size])
+        position += len(batch)
+        if position < len(self.entries):
+            self.cursors[cursor_id] = position
+        else:
+            self.cursors.pop(cursor_id, None)
+            cursor_id = 0
+        return {
+            "cursor": {
+                "firstBatch" if first else "nextBatch": batch,
+                "id": cursor_id,
+                "ns": "admin.$cmd.aggregate"
+            },
+            "ok": 1
+        }
+
+    def command(self, command: Dict) -> Dict:
+        name = next(iter(command))
+        self.commands.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if name == "aggregate":
+            stage = command["pipeline"][0]
+            if "$queryStats" not in stage:
+                raise ValueError(f"Unsupported pipeline stage: {next(iter(stage))}")
+            batch_size = command.get("cursor", {}).get("batchSize", 101)
+            return self._batch(next(self._ids), 0, batch_size, first=True)
+        if name == "getMore":
+            cursor_id = command["getMore"]
+            if cursor_id not in self.cursors:
+                raise ValueError(f"cursor id {cursor_id} not found")
+            return self._batch(cursor_id, self.cursors[cursor_id], command.get("batchSize", 101), first=False)
+        if name == "killCursors":
+            killed = [cursor_id for cursor_id in command["cursors"] if self.cursors.pop(cursor_id, None) is not None]
+            return {"cursorsKilled": killed, "ok": 1}
+        raise ValueError(f"Unsupported command: {name}")
+
+
+class MockQueryStatsClient:
+    """Minimal MongoClient replacement serving `entries` from `$queryStats`"""
+
+    def __init__(self, entries: Sequence[Dict], latency: float = 0.0):
+        self.admin = MockAdminDatabase(entries, latency)
+
+    def close(self):
+        pass
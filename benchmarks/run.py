@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+MongoDB Query Metrics Analyzer - Benchmark Suite
+
+Generates a synthetic dump, then times and memory-profiles each stage of
+the analyzer: parsing, aggregation, console rendering and every JSON API
+route (through Flask's test client). Results are emitted as JSON so runs
+from different versions can be compared. Run from the repository root:
+
+    python -m benchmarks.run --entries 200000 --output results.json
+    python -m benchmarks.run --entries 200000 --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from analyzer import analyze_files, analyze_metrics, get_field_names, reset_caches, shape_cache_info
+from benchmarks.mock_mongo import MockQueryStatsClient
+from benchmarks.synthetic import generate_entries, write_dump
+from console_output import print_console_tables
+from ingest import iter_batch_entries
+from mongo_source import iter_query_stats
+
+
+def measure(name: str, func: Callable[[], object], repeat: int, trace_memory: bool = True, **extra) -> Dict:
+    """Time `func` (best of `repeat`) and record the peak memory it allocates.
+
+    The shape cache is emptied before every call, so each run starts cold
+    and results do not depend on which benchmarks ran before.
+    """
+    timings = []
+    for _ in range(repeat):
+        reset_caches()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    result = {"name": name, "seconds": min(timings), "mean_seconds": sum(timings) / len(timings)}
+    if trace_memory:
+        reset_caches()
+        tracemalloc.start()
+        func()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    result.update(extra)
+    return result
+
+
+def drain(iterator) -> int:
+    count = 0
+    for _ in iterator:
+        count += 1
+    return count
+
+
+def benchmark_routes(results: Dict, shapes: Dict, repeat: int, trace_memory: bool) -> List[Dict]:
+    """Time each /api/* route through Flask's test client"""
+    from web_server import create_web_server
+
+    client = create_web_server(results, shapes).test_client()
+    largest = max(shapes, key=lambda shape_id: len(shapes[shape_id]["hashes"]))
+    hash_val = shapes[largest]["hashes"][0]
+    page = "draw=1&start=0&length=25&order[0][column]=0&order[0][dir]=desc&columns[0][data]={}"
+
+    routes = {
+        "/api/data": "/api/data",
+        "/api/data (page)": "/api/data?" + page.format("execCountTotal"),
+        "/api/data (search)": "/api/data?search[value]=status&" + page.format("execCountTotal"),
+        "/api/shape (full)": f"/api/shape/{largest}",
+        "/api/shape (page)": f"/api/shape/{largest}?" + page.format("execCount"),
+        "/api/query_details": f"/api/query_details/{hash_val}",
+        "/api/diff (page)": "/api/diff?" + page.format("totalExecMillis"),
+    }
+
+    runs = []
+    for name, url in routes.items():
+        # The first request builds any lazily cached payload; report it separately
+        start = time.perf_counter()
+        response = client.get(url)
+        first = time.perf_counter() - start
+        runs.append(measure(f"route {name}", lambda url=url: client.get(url), repeat, trace_memory,
+                            first_request_seconds=first, status=response.status_code,
+                            response_bytes=len(response.data)))
+    return runs
+
+
+def _match_of(query_shape: Dict) -> Dict:
+    """The filter of a find shape or the first $match of an aggregate shape"""
+    if "filter" in query_shape:
+        return query_shape["filter"]
+    for stage in query_shape.get("pipeline", []):
+        if "$match" in stage:
+            return stage["$match"]
+    return {}
+
+
+def run_suite(args) -> Dict:
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dump.ndjson" if args.ndjson else "dump.json")
+        start = time.perf_counter()
+        size = write_dump(path, args.entries, args.hashes, args.namespaces, args.seed,
+                          args.shapes, args.depth, args.ndjson)
+        generate_seconds = time.perf_counter() - start
+
+        entries = list(generate_entries(args.entries, args.hashes, args.namespaces, args.seed, args.shapes, args.depth))
+        matches = [_match_of(batch["key"]["queryShape"]) for batch in entries]
+
+        parse = measure("parse", lambda: drain(iter_batch_entries(path)), args.repeat, args.memory)
+        parse["entries_per_second"] = args.entries / parse["seconds"]
+        parse["bytes_per_second"] = size / parse["seconds"]
+        runs.append(parse)
+        runs.append(measure("get_field_names", lambda: [get_field_names(match) for match in matches],
+                            args.repeat, args.memory))
+        runs.append(measure("aggregate (summary)", lambda: analyze_metrics(entries, detail=False),
+                            args.repeat, args.memory))
+        runs.append(measure("aggregate (detail)", lambda: analyze_metrics(entries), args.repeat, args.memory))
+        runs.append(measure("end to end", lambda: analyze_files([path], detail=False), args.repeat, args.memory))
+        cache = shape_cache_info()  # Of one cold end-to-end analysis
+        runs.append(measure("mongo source (mock)",
+                            lambda: analyze_metrics(iter_query_stats(MockQueryStatsClient(entries, args.latency)),
+                                                    detail=False),
+                            args.repeat, args.memory, latency_seconds=args.latency))
+
+        try:
+            from numpy_engine import analyze_metrics_numpy
+        except ImportError:
+            pass
+        else:
+            runs.append(measure("aggregate (numpy)", lambda: analyze_metrics_numpy(entries, detail=False),
+                                args.repeat, args.memory))
+
+        results, shapes = analyze_metrics(entries)
+        with contextlib.redirect_stdout(io.StringIO()):
+            runs.append(measure("console rendering", lambda: print_console_tables(results, shapes),
+                                args.repeat, args.memory))
+
+        try:
+            runs.extend(benchmark_routes(results, shapes, args.repeat, args.memory))
+        except ImportError as e:
+            print(f"Skipping API routes: {e}", file=sys.stderr)
+
+    return {
+        "config": {
+            "entries": args.entries,
+            "hashes": args.hashes,
+            "shapes": args.shapes,
+            "namespaces": args.namespaces,
+            "depth": args.depth,
+            "seed": args.seed,
+            "ndjson": args.ndjson,
+            "latency": args.latency,
+            "repeat": args.repeat,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "input_bytes": size,
+        "generate_seconds": generate_seconds,
+        "result_shapes": len(results),
+        "shape_cache": cache._asdict(),
+        "runs": runs,
+    }
+
+
+def compare(current: Dict, previous: Dict, threshold: float) -> List[str]:
+    """List runs that got slower than `previous` by more than `threshold` (a fraction)"""
+    before = {run["name"]: run for run in previous.get("runs", [])}
+    regressions = []
+    for run in current["runs"]:
+        baseline = before.get(run["name"])
+        if baseline is None or not baseline["seconds"]:
+            continue
+        change = run["seconds"] / baseline["seconds"] - 1
+        if change > threshold:
+            regressions.append(f"{run['name']}: {baseline['seconds']:.4f}s -> {run['seconds']:.4f}s (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the queryStats analyzer on synthetic input')
+    parser.add_argument('--entries', type=int, default=50000, help='Number of entries')
+    parser.add_argument('--hashes', type=int, default=5000, help='Number of distinct query shape hashes')
+    parser.add_argument('--shapes', type=int, default=200, help='Number of distinct $match field sets')
+    parser.add_argument('--namespaces', type=int, default=10, help='Number of collections')
+    parser.add_argument('--depth', type=int, default=2, help='Maximum $and/$or/$nor nesting depth')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--ndjson', action='store_true', help='Benchmark parsing of newline-delimited input')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds per cursor round trip of the mock server (default: 0.005)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the tracemalloc pass of each benchmark')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', metavar='PREVIOUS', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown fraction reported as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
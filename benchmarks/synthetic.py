@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+MongoDB Query Metrics Analyzer - Synthetic queryStats Generator
+
+Generates realistic `$queryStats` output at configurable scale. Run from the
+repository root to write a dump file:
+
+    python -m benchmarks.synthetic dump.json --entries 500000 --shapes 200
+"""
+import argparse
+import json
+import random
+from typing import Dict, Iterator, List, Sequence
+
+FIELD_POOL = [
+    "status", "customerId", "createdAt", "updatedAt", "region", "type",
+    "items.sku", "items.qty", "owner.name", "owner.email", "tags", "score",
+    "account.tier", "account.flags", "total", "currency", "channel", "priority",
+]
+COMPARISON_OPERATORS = ["$eq", "$in", "$gt", "$gte", "$lt", "$lte", "$ne", "$exists"]
+LOGICAL_OPERATORS = ["$and", "$or", "$nor"]
+COMMANDS = ["aggregate", "aggregate", "aggregate", "find"]
+
+
+def _predicate(rng: random.Random) -> Dict:
+    return {rng.choice(COMPARISON_OPERATORS): "?number" if rng.random() < 0.5 else "?string"}
+
+
+def _match_expression(rng: random.Random, fields: Sequence[str], depth: int) -> Dict:
+    """Build a $match expression over `fields`, nesting logical operators up to `depth` levels"""
+    if depth <= 0 or len(fields) < 2:
+        return {field: _predicate(rng) for field in fields}
+    split = rng.randint(1, len(fields) - 1)
+    expression = {rng.choice(LOGICAL_OPERATORS): [
+        _match_expression(rng, fields[:split], depth - 1),
+        _match_expression(rng, fields[split:], depth - 1),
+    ]}
+    # Some fields stay at the top level next to the logical operator
+    if rng.random() < 0.3:
+        expression[rng.choice(FIELD_POOL)] = _predicate(rng)
+    return expression
+
+
+def _query_shape(rng: random.Random, fields: Sequence[str], namespace: Dict, depth: int) -> Dict:
+    """Build a queryShape for one query shape hash using the given $match fields"""
+    match = _match_expression(rng, list(fields), rng.randint(0, depth))
+    command = rng.choice(COMMANDS)
+    if command == "find":
+        return {"cmdNs": namespace, "command": "find", "filter": match, "sort": {fields[0]: 1}}
+    pipeline = [{"$match": match}, {"$sort": {fields[0]: rng.choice([1, -1])}}]
+    if rng.random() < 0.3:
+        pipeline.append({"$group": {"_id": "$" + fields[-1], "count": {"$sum": "?number"}}})
+    return {"cmdNs": namespace, "command": "aggregate", "pipeline": pipeline}
+
+
+def _metrics(rng: random.Random) -> Dict:
+    """Build cumulative metrics for one entry"""
+    exec_count = rng.randint(1, 10000)
+    mean_micros = rng.lognormvariate(7, 1.5)
+    total_micros = int(exec_count * mean_micros)
+    docs_returned = exec_count * rng.randint(0, 100)
+    return {
+        "lastExecutionMicros": int(mean_micros),
+        "execCount": exec_count,
+        "totalExecMicros": {
+            "sum": total_micros,
+            "max": int(mean_micros * rng.uniform(1, 20)),
+            "min": int(mean_micros * rng.uniform(0.05, 1)),
+            "sumOfSquares": int(exec_count * mean_micros ** 2 * rng.uniform(1, 3)),
+        },
+        "firstResponseExecMicros": {"sum": int(total_micros * rng.uniform(0.5, 1))},
+        "docsReturned": {"sum": docs_returned},
+        "keysExamined": {"sum": docs_returned * rng.randint(0, 5)},
+        "docsExamined": {"sum": docs_returned * rng.randint(0, 20)},
+    }
+
+
+def generate_entries(entries: int = 10000, hashes: int = 1000, namespaces: int = 5, seed: int = 42,
+                     shapes: int = 0, depth: int = 2) -> Iterator[Dict]:
+    """Yield synthetic `$queryStats` entries.
+
+    `shapes` distinct $match field sets (0 = one per hash) are spread over
+    `hashes` query shape hashes and `namespaces` collections; $match
+    expressions nest `$and`/`$or`/`$nor` up to `depth` levels. Every entry
+    picks one hash, so the same `queryShapeHash` recurs across entries as it
+    does for different clients in a real dump; each recurrence gets its own
+    client, so `(queryShapeHash, key)` identifies one entry as in $queryStats.
+    """
+    rng = random.Random(seed)
+    ns_pool = [{"db": f"db{i}", "coll": f"coll{i}"} for i in range(namespaces)]
+    field_sets = [rng.sample(FIELD_POOL, rng.randint(1, 5)) for _ in range(shapes or hashes)]
+    pool: List = []
+    for position in range(hashes):
+        fields = field_sets[position % len(field_sets)]
+        pool.append((f"{rng.getrandbits(256):064X}", _query_shape(rng, fields, rng.choice(ns_pool), depth)))
+
+    occurrences = [0] * hashes
+    for position in range(entries):
+        hash_position = rng.randrange(hashes)
+        query_shape_hash, query_shape = pool[hash_position]
+        occurrence = occurrences[hash_position]
+        occurrences[hash_position] += 1
+        yield {
+            "key": {
+                "queryShape": query_shape,
+                "client": {"application": {"name": f"app{occurrence}"}},
+                "collectionType": "collection",
+            },
+            "keyHash": f"{position:016x}",
+            "queryShapeHash": query_shape_hash,
+            "metrics": _metrics(rng),
+            "asOf": {"$date": "2026-01-01T00:00:00.000Z"},
+        }
+
+
+def generate_reply(entries: int = 10000, hashes: int = 1000, namespaces: int = 5, seed: int = 42,
+                   shapes: int = 0, depth: int = 2) -> Dict:
+    """Build a `$queryStats` command reply holding synthetic entries in `firstBatch`"""
+    return {
+        "cursor": {
+            "firstBatch": list(generate_entries(entries, hashes, namespaces, seed, shapes, depth)),
+            "id": 0,
+            "ns": "admin.$cmd.aggregate"
+        },
+        "ok": 1
+    }
+
+
+def write_dump(path: str, entries: int = 10000, hashes: int = 1000, namespaces: int = 5, seed: int = 42,
+               shapes: int = 0, depth: int = 2, ndjson: bool = False) -> int:
+    """Write synthetic entries to `path` as a command reply or NDJSON; returns the bytes written"""
+    generated = generate_entries(entries, hashes, namespaces, seed, shapes, depth)
+    size = 0
+    with open(path, "w", encoding="utf-8") as file:
+        if ndjson:
+            for batch in generated:
+                size += file.write(json.dumps(batch) + "\n")
+            return size
+        # Written element by element so large dumps never sit in memory
+        size += file.write('{"cursor": {"firstBatch": [')
+        for position, batch in enumerate(generated):
+            size += file.write((", " if position else "") + json.dumps(batch))
+        size += file.write('], "id": 0, "ns": "admin.$cmd.aggregate"}, "ok": 1}')
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic $queryStats output')
+    parser.add_argument('output', help='File to write')
+    parser.add_argument('--entries', type=int, default=10000, help='Number of entries')
+    parser.add_argument('--hashes', type=int, default=1000, help='Number of distinct query shape hashes')
+    parser.add_argument('--shapes', type=int, default=0,
+                        help='Number of distinct $match field sets (default: one per hash)')
+    parser.add_argument('--namespaces', type=int, default=5, help='Number of collections')
+    parser.add_argument('--depth', type=int, default=2, help='Maximum $and/$or/$nor nesting depth')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--ndjson', action='store_true', help='Write one entry per line')
+    args = parser.parse_args()
+
+    size = write_dump(args.output, args.entries, args.hashes, args.namespaces, args.seed,
+                      args.shapes, args.depth, args.ndjson)
+    print(f"Wrote {args.entries} entries ({size / 1e6:.1f} MB) to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,17 @@ MongoDB Query Metrics Analyzer - Console Output Module
 """
 from prettytable import PrettyTable
 
+from efficiency import rank_by_wasted_work
+from profiling import PROFILER
+
+@PROFILER.timed("render")
 def print_console_tables(results, shapes):
     """Print results as console tables"""
     # Create a table with shapes as rows and metrics as columns
     table = PrettyTable()
     
     # Define column headers
-    table.field_names = [
+    field_names = [
         "Shape ID", 
         "Namespace",
         "Shapes Count", 
@@ -24,6 +28,34 @@ def print_console_tables(results, shapes):
         "Docs Examined (avg)"
     ]
     
+    # Efficiency scores (see efficiency); missing from snapshots of earlier versions
+    show_efficiency = any("efficiency" in result for result in results.values())
+    if show_efficiency:
+        field_names += [
+            "Docs Examined/Returned",
+            "Keys Examined/Returned",
+            "Coll Scan Likelihood",
+            "Wasted Exec (ms)"
+        ]
+    
+    # Latency distribution columns, when the engine provides them (see numpy_engine)
+    show_latency = any("latencyMillis" in result for result in results.values())
+    if show_latency:
+        field_names += [
+            "Latency Stddev (ms)",
+            "Latency Min (ms)",
+            "Latency Max (ms)",
+            "Latency p50 (ms)",
+            "Latency p95 (ms)",
+            "Latency p99 (ms)"
+        ]
+    
+    # Ranking estimate of each shape in top-K mode (see heavy_hitters)
+    show_top_k = any("topK" in result for result in results.values())
+    if show_top_k:
+        field_names.append("Top-K Estimate (max error)")
+    table.field_names = field_names
+    
     # Set right alignment for numeric columns
     for field in table.field_names:
         if field not in ["Shape ID", "Namespace"]:
@@ -31,13 +63,12 @@ def print_console_tables(results, shapes):
     
     # Add a row for each query shape
     for shape_id, result in results.items():
-        # Get the namespace from the first hash in this shape
         shape_info = shapes[shape_id]
-        first_hash = shape_info["hashes"][0] if shape_info["hashes"] else ""
-        namespace = shape_info["original_data"][first_hash].get("namespace", "") if first_hash else ""
+        namespace = shape_info.get("namespace", "")
         
+        top_k = result.get("topK", {})
         row = [
-            f"Shape {shape_id}",
+            "Other" if top_k.get("other") else f"Shape {shape_id}",
             namespace,
             result["shapes_count"],
             result["execCount"]["total"],
@@ -50,6 +81,21 @@ def print_console_tables(results, shapes):
             result["docsExamined"]["total"],
             f"{result['docsExamined']['avg']:.2f}"
         ]
+        if show_efficiency:
+            efficiency = result.get("efficiency", {})
+            row += [
+                f"{efficiency.get('docsExaminedPerReturned', 0):.2f}",
+                f"{efficiency.get('keysExaminedPerReturned', 0):.2f}",
+                f"{efficiency.get('collScanLikelihood', 0):.0%}",
+                f"{efficiency.get('wastedExecMillis', 0):.2f}"
+            ]
+        if show_latency:
+            latency = result.get("latencyMillis", {})
+            row.extend(f"{latency.get(name, 0):.2f}" for name in ("stddev", "min", "max", "p50", "p95", "p99"))
+        if show_top_k:
+            estimate = f"{top_k['estimate']:.2f} ({top_k['maxError']:.2f})" if "estimate" in top_k else ""
+            # The shape may not belong in the top K at all when most of its estimate is error
+            row.append(estimate + " low confidence" if top_k.get("lowConfidence") else estimate)
         table.add_row(row)
     
     # Sort by total execution count (descending)
@@ -63,14 +109,107 @@ def print_console_tables(results, shapes):
     # Create and print reference table for shape IDs and field names
     print("\nQuery Shape Reference:")
     ref_table = PrettyTable()
-    ref_table.field_names = ["Shape ID", "Namespace", "Field Names"]
+    # Components of the grouping key, when grouped by more than the field names (see --group-by)
+    show_group = any("group" in shape_info for shape_info in shapes.values())
+    ref_table.field_names = ["Shape ID", "Namespace", "Field Names"] + (["Group"] if show_group else [])
+    if show_group:
+        ref_table.align["Group"] = "l"
     
     for shape_id, shape_info in shapes.items():
-        # Get the namespace from the first hash in this shape
-        first_hash = shape_info["hashes"][0] if shape_info["hashes"] else ""
-        namespace = shape_info["original_data"][first_hash].get("namespace", "") if first_hash else ""
+        namespace = shape_info.get("namespace", "")
         
+        top_k = results.get(shape_id, {}).get("topK", {})
+        if top_k.get("other"):
+            row = ["Other", "", f"Shapes outside the top K by {top_k['metric']} ({top_k['evictions']} evictions, "
+                                f"{top_k.get('belowTopK', 0)} tracked below the top K)"]
+        else:
+            field_str = ", ".join(shape_info["field_names"]) if shape_info["field_names"] else "No fields"
+            row = [f"Shape {shape_id}", namespace, field_str]
+        if show_group:
+            row.append("; ".join(f"{name}={label}" for name, label in shape_info.get("group", {}).items()))
+        ref_table.add_row(row)
+    
+    print(ref_table)
+    
+    # Shapes wasting the most execution time, with the index that would serve them
+    ranked = rank_by_wasted_work(results)
+    if ranked:
+        print("\nWasted Work Ranking (execution time spent on examined but unreturned data):")
+        waste_table = PrettyTable()
+        waste_table.field_names = ["Rank", "Shape ID", "Namespace", "Wasted Exec (ms)",
+                                   "Docs Examined/Returned", "Coll Scan Likelihood", "Index Candidate (ESR)"]
+        for field in ("Wasted Exec (ms)", "Docs Examined/Returned", "Coll Scan Likelihood"):
+            waste_table.align[field] = "r"
+        waste_table.align["Index Candidate (ESR)"] = "l"
+        for rank, shape_id in enumerate(ranked, start=1):
+            result = results[shape_id]
+            efficiency = result["efficiency"]
+            waste_table.add_row([
+                rank,
+                f"Shape {shape_id}",
+                shapes[shape_id].get("namespace", ""),
+                f"{efficiency['wastedExecMillis']:.2f}",
+                f"{efficiency['docsExaminedPerReturned']:.2f}",
+                f"{efficiency['collScanLikelihood']:.0%}",
+                efficiency.get("indexCandidate") or "-"
+            ])
+        print(waste_table)
+
+@PROFILER.timed("render")
+def print_diff_tables(results, shapes, interval_seconds=None):
+    """Print per-shape activity between two snapshots as console tables"""
+    table = PrettyTable()
+    
+    # Define column headers
+    table.field_names = [
+        "Shape ID",
+        "Namespace",
+        "Entries",
+        "Execs",
+        "Exec Time (ms)",
+        "Docs Examined",
+        "Keys Examined",
+        "Execs/sec",
+        "Exec ms/sec",
+        "Docs Examined/sec"
+    ]
+    
+    # Set right alignment for numeric columns
+    for field in table.field_names:
+        if field not in ["Shape ID", "Namespace"]:
+            table.align[field] = "r"
+    
+    # Hottest shapes first: by execution time spent during the interval
+    ordered = sorted(results.items(), key=lambda item: item[1]["totalExecMillis"]["total"], reverse=True)
+    for shape_id, result in ordered:
+        rates = result.get("rates")
+        table.add_row([
+            f"Shape {shape_id}",
+            shapes[shape_id].get("namespace", ""),
+            result["shapes_count"],
+            result["execCount"]["total"],
+            f"{result['totalExecMillis']['total']:.2f}",
+            result["docsExamined"]["total"],
+            result["keysExamined"]["total"],
+            f"{rates['execsPerSec']:.2f}" if rates else "n/a",
+            f"{rates['execMillisPerSec']:.2f}" if rates else "n/a",
+            f"{rates['docsExaminedPerSec']:.2f}" if rates else "n/a"
+        ])
+    
+    if interval_seconds:
+        print(f"\nActivity over {interval_seconds:.0f} seconds:")
+    else:
+        print("\nActivity between snapshots (interval unknown, rates not available):")
+    print(table)
+    
+    # Create and print reference table for shape IDs and field names
+    print("\nQuery Shape Reference:")
+    ref_table = PrettyTable()
+    ref_table.field_names = ["Shape ID", "Namespace", "Field Names"]
+    
+    for shape_id, _ in ordered:
+        shape_info = shapes[shape_id]
         field_str = ", ".join(shape_info["field_names"]) if shape_info["field_names"] else "No fields"
-        ref_table.add_row([f"Shape {shape_id}", namespace, field_str])
+        ref_table.add_row([f"Shape {shape_id}", shape_info.get("namespace", ""), field_str])
     
     print(ref_table)
@@ -0,0 +1,116 @@
+"""
+MongoDB Query Metrics Analyzer - Snapshot Delta Module
+
+queryStats metrics are cumulative since each entry was created, so the
+activity during an interval is the difference between two dumps taken at
+its start and end. Entries are joined by queryShapeHash plus `key`.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from analyzer import MetricsAggregator, entry_key
+
+# Metrics differenced between snapshots, as (metric, sub-field)
+DELTA_METRICS = (
+    ("totalExecMicros", "sum"),
+    ("docsReturned", "sum"),
+    ("keysExamined", "sum"),
+    ("docsExamined", "sum"),
+)
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Convert an `asOf`-style timestamp (extended JSON, ISO string or epoch millis) to epoch seconds"""
+    if isinstance(value, dict):
+        value = value.get("$date", value.get("$numberLong"))
+        if isinstance(value, dict):
+            value = value.get("$numberLong")
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000.0
+    if isinstance(value, str):
+        if value.lstrip("-").isdigit():
+            return int(value) / 1000.0
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _counters(metrics: Dict) -> Tuple[int, ...]:
+    """The cumulative counters of an entry, in DELTA_METRICS order after execCount"""
+    values = [metrics.get("execCount", 0)]
+    for name, field in DELTA_METRICS:
+        value = metrics.get(name)
+        values.append(value.get(field, 0) if isinstance(value, dict) else 0)
+    return tuple(values)
+
+
+def index_entries(entries: Iterable[Dict]) -> Tuple[Dict[Tuple[str, str], Tuple[int, ...]], Optional[float]]:
+    """Build the join index of a baseline dump: (hash, key) -> counters, plus its latest asOf"""
+    index = {}
+    latest = None
+    for batch in entries:
+        query_shape_hash = batch.get("queryShapeHash")
+        metrics = batch.get("metrics")
+        if not query_shape_hash or metrics is None:
+            continue
+        index[(query_shape_hash, entry_key(batch))] = _counters(metrics)
+        as_of = parse_timestamp(batch.get("asOf"))
+        if as_of is not None and (latest is None or as_of > latest):
+            latest = as_of
+    return index, latest
+
+
+def diff_entries(old_entries: Iterable[Dict], new_entries: Iterable[Dict], detail: bool = True,
+                 interval_seconds: Optional[float] = None) -> Tuple[Dict[int, Dict], Dict[int, Dict], Optional[float]]:
+    """Aggregate the per-shape activity between two dumps.
+
+    The baseline is indexed first, then the newer dump is streamed once;
+    each entry contributes the difference of its cumulative counters (or its
+    full counters if it is new or was reset). Entries with no executions in
+    the interval are left out. Returns `(results, shapes, interval_seconds)`
+    in the analyze_metrics format, with a `rates` section per shape when the
+    interval is known (from `interval_seconds` or the dumps' `asOf` times).
+    """
+    old_index, old_as_of = index_entries(old_entries)
+    aggregator = MetricsAggregator(detail=detail)
+    new_as_of = None
+
+    for batch in new_entries:
+        query_shape_hash = batch.get("queryShapeHash")
+        metrics = batch.get("metrics")
+        if not query_shape_hash or metrics is None:
+            continue
+        as_of = parse_timestamp(batch.get("asOf"))
+        if as_of is not None and (new_as_of is None or as_of > new_as_of):
+            new_as_of = as_of
+
+        counters = _counters(metrics)
+        previous = old_index.get((query_shape_hash, entry_key(batch)))
+        if previous is not None and previous[0] <= counters[0]:
+            counters = tuple(new - old for new, old in zip(counters, previous))
+        if counters[0] <= 0:
+            continue
+
+        delta_metrics = {"execCount": counters[0]}
+        for (name, field), value in zip(DELTA_METRICS, counters[1:]):
+            delta_metrics[name] = {field: value}
+        aggregator.add({"key": batch.get("key", {}), "queryShapeHash": query_shape_hash, "metrics": delta_metrics})
+
+    if interval_seconds is None and old_as_of is not None and new_as_of is not None and new_as_of > old_as_of:
+        interval_seconds = new_as_of - old_as_of
+
+    results, shapes = aggregator.finalize()
+    if interval_seconds:
+        for result in results.values():
+            result["rates"] = {
+                "intervalSeconds": interval_seconds,
+                "execsPerSec": result["execCount"]["total"] / interval_seconds,
+                "execMillisPerSec": result["totalExecMillis"]["total"] / interval_seconds,
+                "docsExaminedPerSec": result["docsExamined"]["total"] / interval_seconds,
+                "keysExaminedPerSec": result["keysExamined"]["total"] / interval_seconds,
+            }
+    return results, shapes, interval_seconds
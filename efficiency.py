@@ -0,0 +1,103 @@
+"""
+MongoDB Query Metrics Analyzer - Efficiency Module
+
+Efficiency scores derived from the examined/returned counters, and
+candidate compound index key orders derived from the predicates of each
+shape following the equality, sort, range (ESR) guideline.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+EQUALITY_OPERATORS = frozenset(("$eq", "$in"))  # Everything else on a field bounds a range
+WASTE_RANKING_SIZE = 10  # Shapes listed in the console's wasted work ranking
+
+
+def efficiency_scores(total_exec_micros: float, docs_returned: int, keys_examined: int,
+                      docs_examined: int) -> Dict[str, float]:
+    """Efficiency of the work behind the given totals (of a shape, hash or entry).
+
+    Ratios are taken against at least one returned document, so a query
+    that scans and returns nothing still scores its scan. The collection
+    scan likelihood is the share of examined documents not reached through
+    index keys; wasted time is execution time scaled by the share of
+    examined keys/documents that were not returned.
+    """
+    returned = max(docs_returned, 1)
+    examined = max(docs_examined, keys_examined)
+    wasted_share = (examined - min(docs_returned, examined)) / examined if examined else 0.0
+    return {
+        "docsExaminedPerReturned": docs_examined / returned,
+        "keysExaminedPerReturned": keys_examined / returned,
+        "collScanLikelihood": max(0.0, 1.0 - keys_examined / docs_examined) if docs_examined else 0.0,
+        "wastedExecMillis": total_exec_micros / 1000.0 * wasted_share
+    }
+
+
+class IndexPredicates:
+    """Fields a shape filters on by equality or range, and the fields it sorts on.
+
+    Collected once per query shape hash; a field used both ways (in one
+    hash or across hashes of the shape) counts as a range field. Filters
+    with an $or are disjunctive: each branch would need its own index, so
+    no single candidate is suggested for them.
+    """
+    __slots__ = ("equality", "range", "sort", "disjunctive")
+
+    def __init__(self):
+        # Insertion-ordered sets (sort maps each field to its first direction)
+        self.equality: Dict[str, None] = {}
+        self.range: Dict[str, None] = {}
+        self.sort: Dict[str, int] = {}
+        self.disjunctive = False
+
+    def add(self, field_operators: Iterable[Tuple[str, Tuple[str, ...]]], sort: Iterable[Tuple[str, int]],
+            disjunctive: bool = False):
+        """Record the `(field, operators)` of a $match and the `(field, direction)` of a $sort.
+
+        `disjunctive` marks a $match with an $or; it sticks to the shape.
+        """
+        self.disjunctive = self.disjunctive or disjunctive
+        for field, operators in field_operators:
+            for operator in operators:
+                if not operator.startswith("$"):
+                    continue
+                if operator in EQUALITY_OPERATORS:
+                    self.equality[field] = None
+                else:
+                    self.range[field] = None
+        for field, direction in sort:
+            self.sort.setdefault(field, direction)
+
+    def merge(self, other: "IndexPredicates"):
+        self.disjunctive = self.disjunctive or other.disjunctive
+        self.equality.update(other.equality)
+        self.range.update(other.range)
+        for field, direction in other.sort.items():
+            self.sort.setdefault(field, direction)
+
+    def key_pattern(self) -> List[Tuple[str, int]]:
+        """Candidate compound index: equality fields, then sort fields, then range fields"""
+        equality = sorted(field for field in self.equality if field not in self.range)
+        keys = [(field, 1) for field in equality]
+        used = set(equality)
+        keys.extend((field, direction) for field, direction in self.sort.items() if field not in used)
+        used.update(self.sort)
+        keys.extend((field, 1) for field in sorted(self.range) if field not in used)
+        return keys
+
+    def candidate(self) -> str:
+        """key_pattern() in the shell's index key syntax, e.g. `{status: 1, createdAt: -1}` ("" for $or filters)"""
+        if self.disjunctive:
+            return ""
+        keys = self.key_pattern()
+        if not keys:
+            return ""
+        return "{" + ", ".join(f"{field}: {direction}" for field, direction in keys) + "}"
+
+
+def rank_by_wasted_work(results: Dict[int, Dict], limit: int = WASTE_RANKING_SIZE) -> List[int]:
+    """IDs of the shapes with the most wasted execution time, most first (top-K roll-ups excluded)"""
+    ranked = sorted((shape_id for shape_id, result in results.items()
+                     if result.get("efficiency", {}).get("wastedExecMillis", 0) > 0
+                     and not result.get("topK", {}).get("other")),
+                    key=lambda shape_id: results[shape_id]["efficiency"]["wastedExecMillis"], reverse=True)
+    return ranked[:limit]
@@ -0,0 +1,318 @@
+"""
+MongoDB Query Metrics Analyzer - Export Module
+
+Writes per-entry, per-hash and per-shape metrics as typed tables for
+analytics tools: Parquet or Arrow IPC files (requires the pyarrow package)
+or CSV. Entry rows are written in batches while the entries stream into
+the analysis, so exporting a large dump never holds all of its rows.
+"""
+import csv
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from analyzer import DEFAULT_GROUP_BY, extract_match_shape_and_hash, group_labels, grouping
+from delta import parse_timestamp
+from efficiency import efficiency_scores
+from profiling import PROFILER
+
+EXPORT_FORMATS = ("parquet", "arrow", "csv")
+EXPORT_BATCH_ROWS = 65536  # Rows buffered per written batch (Parquet row group / Arrow record batch)
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+# Table columns as (name, type); "dictionary" columns hold repeated strings
+# (the shape grouping and namespaces) and are dictionary-encoded in Arrow
+ENTRY_COLUMNS = (
+    ("shape", "dictionary"),
+    ("namespace", "dictionary"),
+    ("queryShapeHash", "string"),
+    ("asOf", "timestamp"),
+    ("execCount", "int"),
+    ("totalExecMicros", "int"),
+    ("firstResponseExecMicros", "int"),
+    ("docsReturned", "int"),
+    ("keysExamined", "int"),
+    ("docsExamined", "int"),
+)
+# Summed over a hash's entries, in the order of ENTRY_COLUMNS after asOf
+HASH_TOTALS = ("execCount", "totalExecMicros", "firstResponseExecMicros", "docsReturned", "keysExamined",
+               "docsExamined")
+HASH_COLUMNS = (
+    ("queryShapeHash", "string"),
+    ("shape", "dictionary"),
+    ("namespace", "dictionary"),
+    ("entries", "int"),
+) + tuple((name, "int") for name in HASH_TOTALS) + (
+    ("docsExaminedPerReturned", "float"),
+    ("collScanLikelihood", "float"),
+    ("wastedExecMillis", "float"),
+)
+SHAPE_COLUMNS = (
+    ("shapeId", "int"),
+    ("shape", "dictionary"),
+    ("namespace", "dictionary"),
+    ("hashes", "int"),
+    ("entries", "int"),
+    ("execCount", "int"),
+    ("totalExecMillis", "float"),
+    ("avgExecMillis", "float"),
+    ("docsReturned", "int"),
+    ("keysExamined", "int"),
+    ("docsExamined", "int"),
+    ("docsExaminedPerReturned", "float"),
+    ("keysExaminedPerReturned", "float"),
+    ("collScanLikelihood", "float"),
+    ("wastedExecMillis", "float"),
+    ("indexCandidate", "string"),
+)
+
+
+def default_format() -> str:
+    """Parquet when pyarrow is installed, CSV otherwise"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "csv"
+    return "parquet"
+
+
+def shape_label(shape_key: tuple) -> str:
+    """A shape grouping key (see analyzer.configure_grouping) as a single string"""
+    if grouping() == DEFAULT_GROUP_BY:
+        return ", ".join(shape_key)
+    return _group_label(group_labels(shape_key))
+
+
+def _group_label(labels: Dict[str, str]) -> str:
+    return "; ".join(f"{name}={label}" for name, label in labels.items())
+
+
+def namespace_label(namespace: Any) -> str:
+    """A cmdNs value as 'db.coll'"""
+    if isinstance(namespace, dict):
+        return f"{namespace.get('db', '')}.{namespace.get('coll', '')}"
+    return str(namespace) if namespace is not None else ""
+
+
+def _sum(metrics: Dict, name: str) -> int:
+    value = metrics.get(name)
+    return value.get("sum", 0) if isinstance(value, dict) else 0
+
+
+class _CsvTable:
+    """Streaming CSV table writer"""
+
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+        self.timestamps = [position for position, (_, kind) in enumerate(columns) if kind == "timestamp"]
+
+    def write(self, columns: List[list]):
+        columns = list(columns)  # The caller's column lists are reused
+        for position in self.timestamps:
+            columns[position] = [datetime.fromtimestamp(value, timezone.utc).isoformat() if value is not None
+                                 else None for value in columns[position]]
+        self.writer.writerows(zip(*columns))
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowTable:
+    """Batched Parquet/Arrow IPC table writer with typed, dictionary-encoded columns.
+
+    Dictionary columns share one dictionary that only grows, so every
+    batch extends the previous batch's dictionary (as Arrow IPC files
+    require) and repeated values are stored once.
+    """
+
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]], export_format: str):
+        import pyarrow as pa
+
+        self.pa = pa
+        types = {
+            "dictionary": pa.dictionary(pa.int32(), pa.string()),
+            "string": pa.string(),
+            "timestamp": pa.timestamp("ms", tz="UTC"),
+            "int": pa.int64(),
+            "float": pa.float64(),
+        }
+        self.kinds = [kind for _, kind in columns]
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.dictionaries: Dict[int, Dict[str, int]] = {
+            position: {} for position, kind in enumerate(self.kinds) if kind == "dictionary"}
+        if export_format == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema,
+                                          options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def _array(self, position: int, values: list):
+        pa = self.pa
+        kind = self.kinds[position]
+        if kind == "dictionary":
+            dictionary = self.dictionaries[position]
+            indices = [dictionary.setdefault(value, len(dictionary)) for value in values]
+            return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(dictionary),
+                                                                                          pa.string()))
+        if kind == "timestamp":
+            values = [int(value * 1000) if value is not None else None for value in values]
+        return pa.array(values, self.schema.field(position).type)
+
+    def write(self, columns: List[list]):
+        arrays = [self._array(position, values) for position, values in enumerate(columns)]
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class Exporter:
+    """Export of an analysis to `directory` as entries, hashes and shapes tables.
+
+    Entries are recorded by passing them through tee() on their way into
+    the analysis; per-hash totals are kept as they pass (memory grows with
+    the number of distinct hashes, not entries). finish() writes the hash
+    and shape tables from the final results.
+    """
+
+    def __init__(self, directory: str, export_format: Optional[str] = None,
+                 batch_rows: int = EXPORT_BATCH_ROWS):
+        self.directory = directory
+        self.format = export_format or default_format()
+        if self.format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{self.format}' (choose from {', '.join(EXPORT_FORMATS)})")
+        self.batch_rows = batch_rows
+        os.makedirs(directory, exist_ok=True)
+        self.entries = self._open("entries", ENTRY_COLUMNS)
+        self.entry_count = 0
+        self.hash_count = 0
+        self.shape_count = 0
+        # queryShapeHash -> [shape, namespace, entries, HASH_TOTALS...]
+        self.hashes: Dict[str, list] = {}
+        self._buffer: List[list] = [[] for _ in ENTRY_COLUMNS]
+        self._closed = False
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.directory, table + EXTENSIONS[self.format])
+
+    def _open(self, table: str, columns: Sequence[Tuple[str, str]]):
+        if self.format == "csv":
+            return _CsvTable(self.path(table), columns)
+        return _ArrowTable(self.path(table), columns, self.format)
+
+    def tee(self, entries: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield `entries` unchanged, recording each one for export"""
+        buffer = self._buffer
+        shape, namespace, hashes, as_of, exec_count, total_exec, first_response, returned, keys, docs = buffer
+        hash_totals = self.hashes
+        for batch in entries:
+            metrics = batch.get("metrics")
+            if metrics is not None:
+                query_shape_hash, shape_key, cmd_ns = extract_match_shape_and_hash(batch)
+            if metrics is not None and query_shape_hash:
+                values = (metrics.get("execCount", 0), _sum(metrics, "totalExecMicros"),
+                          _sum(metrics, "firstResponseExecMicros"), _sum(metrics, "docsReturned"),
+                          _sum(metrics, "keysExamined"), _sum(metrics, "docsExamined"))
+                totals = hash_totals.get(query_shape_hash)
+                if totals is None:
+                    totals = hash_totals[query_shape_hash] = [shape_label(shape_key), namespace_label(cmd_ns),
+                                                              0] + [0] * len(HASH_TOTALS)
+                totals[2] += 1
+                for position, value in enumerate(values, start=3):
+                    totals[position] += value
+
+                shape.append(totals[0])
+                namespace.append(totals[1])
+                hashes.append(query_shape_hash)
+                as_of.append(parse_timestamp(batch.get("asOf")))
+                exec_count.append(values[0])
+                total_exec.append(values[1])
+                first_response.append(values[2])
+                returned.append(values[3])
+                keys.append(values[4])
+                docs.append(values[5])
+                if len(hashes) >= self.batch_rows:
+                    self._flush_entries()
+            yield batch
+
+    @PROFILER.timed("export")
+    def _flush_entries(self):
+        rows = len(self._buffer[0])
+        if rows:
+            self.entries.write(self._buffer)
+            self.entry_count += rows
+            PROFILER.count("export.rows", rows)
+            for column in self._buffer:
+                column.clear()
+
+    def _write_table(self, table: str, columns: Sequence[Tuple[str, str]], rows: Iterable[tuple]) -> int:
+        writer = self._open(table, columns)
+        count = 0
+        batch = []
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_rows:
+                    writer.write([list(column) for column in zip(*batch)])
+                    count += len(batch)
+                    batch = []
+            if batch:
+                writer.write([list(column) for column in zip(*batch)])
+                count += len(batch)
+        finally:
+            writer.close()
+        PROFILER.count("export.rows", count)
+        return count
+
+    def _hash_rows(self) -> Iterator[tuple]:
+        for query_shape_hash, totals in self.hashes.items():
+            scores = efficiency_scores(totals[4], totals[6], totals[7], totals[8])
+            yield (query_shape_hash, *totals, scores["docsExaminedPerReturned"], scores["collScanLikelihood"],
+                   scores["wastedExecMillis"])
+
+    @staticmethod
+    def _shape_rows(results: Dict[int, Dict], shapes: Dict[int, Dict]) -> Iterator[tuple]:
+        for shape_id, result in results.items():
+            shape_info = shapes[shape_id]
+            efficiency = result.get("efficiency", {})
+            # The top-K roll-up of other shapes has no field names of its own (see heavy_hitters)
+            other = result.get("topK", {}).get("other", False)
+            yield (
+                shape_id,
+                "Other" if other else (_group_label(shape_info["group"]) if "group" in shape_info
+                                       else ", ".join(shape_info["field_names"])),
+                namespace_label(shape_info.get("namespace", "")),
+                len(shape_info["hashes"]),
+                result["shapes_count"],
+                result["execCount"]["total"],
+                result["totalExecMillis"]["total"],
+                result["avgExecMillis"]["avg"],
+                result["docsReturned"]["total"],
+                result["keysExamined"]["total"],
+                result["docsExamined"]["total"],
+                efficiency.get("docsExaminedPerReturned", 0.0),
+                efficiency.get("keysExaminedPerReturned", 0.0),
+                efficiency.get("collScanLikelihood", 0.0),
+                efficiency.get("wastedExecMillis", 0.0),
+                efficiency.get("indexCandidate", ""),
+            )
+
+    @PROFILER.timed("export")
+    def finish(self, results: Dict[int, Dict], shapes: Dict[int, Dict]):
+        """Write the remaining entries, then the hash and shape tables, and close the export"""
+        if self._closed:
+            return
+        self._flush_entries()
+        self.close()
+        self.hash_count = self._write_table("hashes", HASH_COLUMNS, self._hash_rows())
+        self.shape_count = self._write_table("shapes", SHAPE_COLUMNS, self._shape_rows(results, shapes))
+
+    def close(self):
+        """Close the entries table (e.g. when the analysis failed)"""
+        if not self._closed:
+            self._closed = True
+            self.entries.close()
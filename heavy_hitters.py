@@ -0,0 +1,284 @@
+"""
+MongoDB Query Metrics Analyzer - Heavy Hitters Module
+
+Top-K aggregation with memory bounded independently of the number of
+distinct shapes and hashes. Shapes, and hashes within each shape, are
+tracked by weighted Space-Saving summaries several times larger than K, of
+which only the top K are reported; everything else is rolled into a single
+"other" bucket, so totals are preserved.
+"""
+import heapq
+import itertools
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from analyzer import MetricsAggregator, ShapeAccumulator, extract_match_shape, shape_info
+from profiling import PROFILER
+
+TOP_K = 100  # Shapes tracked by default
+HASHES_PER_SHAPE = 50  # Query shape hashes tracked within each shape
+SUMMARY_FACTOR = 10  # Shapes tracked per reported shape...
+MIN_SUMMARY = 1000  # ...and at least this many, so small K still ranks accurately
+LOW_CONFIDENCE_ERROR = 0.5  # Share of an estimate that, as max error, marks it low confidence
+
+
+def _sum_of(metric: str) -> Callable[[Dict], int]:
+    def weight(metrics: Dict) -> int:
+        value = metrics.get(metric)
+        return value.get("sum", 0) if isinstance(value, dict) else 0
+    return weight
+
+
+# Ranking metrics: name -> (weight of an entry's metrics, scale to the reported unit,
+# the ShapeAccumulator attribute holding the same total)
+TOP_METRICS: Dict[str, Tuple[Callable[[Dict], int], float, str]] = {
+    "totalExecMillis": (_sum_of("totalExecMicros"), 1 / 1000.0, "total_exec_micros"),
+    "execCount": (lambda metrics: metrics.get("execCount", 0), 1.0, "exec_count"),
+    "docsExamined": (_sum_of("docsExamined"), 1.0, "docs_examined"),
+    "keysExamined": (_sum_of("keysExamined"), 1.0, "keys_examined"),
+}
+
+
+class SpaceSaving:
+    """Weighted Space-Saving summary of the heaviest keys of a stream.
+
+    At most `capacity` keys are kept. A new key replaces the lightest one
+    and inherits its weight as `errors[key]`, so every tracked weight
+    overestimates the key's true weight by at most its error, and any key
+    heavier than total/capacity is guaranteed to be tracked.
+    """
+    __slots__ = ("capacity", "weights", "errors", "_heap", "_order")
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("SpaceSaving capacity must be at least 1")
+        self.capacity = capacity
+        self.weights: Dict[Hashable, float] = {}
+        self.errors: Dict[Hashable, float] = {}
+        # One (weight, order, key) entry per tracked key; weights only grow, so
+        # an entry may be stale (too low) until it reaches the top of the heap
+        self._heap = []
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.weights
+
+    def _pop_lightest(self) -> Tuple[Hashable, float]:
+        heap = self._heap
+        while True:
+            weight, _, key = heap[0]
+            current = self.weights[key]
+            if current == weight:
+                heapq.heappop(heap)
+                del self.weights[key]
+                del self.errors[key]
+                return key, weight
+            heapq.heapreplace(heap, (current, next(self._order), key))
+
+    def add(self, key: Hashable, weight: float = 1, error: float = 0) -> Optional[Hashable]:
+        """Add `weight` to `key`; returns the key evicted to make room for it, if any.
+
+        `error` is an overestimate already contained in `weight` (when
+        merging another summary).
+        """
+        weights = self.weights
+        if key in weights:
+            weights[key] += weight
+            self.errors[key] += error
+            return None
+
+        evicted = None
+        inherited = 0
+        if len(weights) >= self.capacity:
+            evicted, inherited = self._pop_lightest()
+        weights[key] = inherited + weight
+        self.errors[key] = inherited + error
+        heapq.heappush(self._heap, (weights[key], next(self._order), key))
+        return evicted
+
+    def ranked(self):
+        """Tracked keys, heaviest first"""
+        return sorted(self.weights, key=self.weights.__getitem__, reverse=True)
+
+
+class TopKAggregator(MetricsAggregator):
+    """MetricsAggregator reporting only the top `k` shapes by `metric`.
+
+    Shapes (and within each, the top `hashes_per_shape` hashes) are chosen
+    by weighted Space-Saving over max(SUMMARY_FACTOR * k, MIN_SUMMARY)
+    shapes. The totals of evicted shapes move to an "other" accumulator;
+    with those of tracked shapes outside the top `k` it is reported as the
+    last shape with `result["topK"]["other"]` set. Per-hash drill-down data
+    is dropped with the hash. Memory is O(k * hashes_per_shape) whatever
+    the number of distinct shapes in the input. Shape IDs follow the ranking.
+    """
+
+    def __init__(self, k: int = TOP_K, metric: str = "totalExecMillis", detail: bool = True,
+                 hashes_per_shape: int = HASHES_PER_SHAPE):
+        if metric not in TOP_METRICS:
+            raise ValueError(f"Unknown top-K metric '{metric}' (choose from {', '.join(TOP_METRICS)})")
+        super().__init__(detail=detail)
+        self.k = k
+        self.metric = metric
+        self.hashes_per_shape = hashes_per_shape
+        self.summary = SpaceSaving(max(SUMMARY_FACTOR * k, MIN_SUMMARY))
+        self.hash_summaries: Dict[tuple, SpaceSaving] = {}
+        self.hash_evictions: Dict[tuple, int] = {}  # Hash evictions within each tracked shape
+        self.other = ShapeAccumulator()
+        self.evictions = 0
+
+    def _evict(self, shape_key: tuple):
+        """Fold an evicted shape into the "other" bucket"""
+        accumulator = self.shapes.pop(shape_key)
+        self.other.merge(accumulator)
+        self.evictions += 1
+        self.hash_evictions.pop(shape_key, None)
+        hashes = self.hash_summaries.pop(shape_key)
+        if self.detail:
+            for hash_val in hashes.weights:
+                self.original_data.pop(hash_val, None)
+
+    def _track_hash(self, shape_key: tuple, query_shape_hash: str, weight: float, error: float = 0):
+        evicted = self.hash_summaries[shape_key].add(query_shape_hash, weight, error)
+        if evicted is not None:
+            self.hash_evictions[shape_key] = self.hash_evictions.get(shape_key, 0) + 1
+            if self.detail:
+                self.original_data.pop(evicted, None)
+
+    def add(self, batch: Dict):
+        """Fold a single queryStats entry into the tracked shapes or the "other" bucket"""
+        metrics = batch.get("metrics")
+        if metrics is None:
+            return
+        query_shape_hash, shape_key, namespace, predicates = extract_match_shape(batch)
+        if not query_shape_hash:
+            return
+
+        weight = TOP_METRICS[self.metric][0](metrics)
+        evicted = self.summary.add(shape_key, weight)
+        if evicted is not None:
+            self._evict(evicted)
+
+        accumulator = self.shapes.get(shape_key)
+        if accumulator is None:
+            accumulator = self.shapes[shape_key] = ShapeAccumulator(namespace)
+            self.hash_summaries[shape_key] = SpaceSaving(self.hashes_per_shape)
+        accumulator.add(metrics)
+        if query_shape_hash not in self.hash_summaries[shape_key]:
+            accumulator.predicates.add(*predicates)
+        # A hash is always tracked right after being added (possibly evicting another)
+        self._track_hash(shape_key, query_shape_hash, weight)
+
+        if self.detail:
+            hash_data = self.original_data.get(query_shape_hash)
+            if hash_data is None:
+                hash_data = self.original_data[query_shape_hash] = {
+                    "query_shape": batch.get("key", {}).get("queryShape", {}),
+                    "metrics": [],
+                    "namespace": namespace
+                }
+            hash_data["metrics"].append(metrics)
+
+    def merge(self, other: "TopKAggregator"):
+        """Fold another top-K aggregate (e.g. from another file) into this one.
+
+        Tracked weights and error bounds of the other summary are added;
+        shapes that no longer fit are rolled into "other" as usual.
+        """
+        for shape_key, other_accumulator in other.shapes.items():
+            evicted = self.summary.add(shape_key, other.summary.weights[shape_key],
+                                       other.summary.errors[shape_key])
+            if evicted is not None:
+                self._evict(evicted)
+
+            accumulator = self.shapes.get(shape_key)
+            if accumulator is None:
+                accumulator = self.shapes[shape_key] = ShapeAccumulator(other_accumulator.namespace)
+                self.hash_summaries[shape_key] = SpaceSaving(self.hashes_per_shape)
+            accumulator.merge(other_accumulator)
+            self.hash_evictions[shape_key] = (self.hash_evictions.get(shape_key, 0)
+                                                + other.hash_evictions.get(shape_key, 0))
+
+            other_hashes = other.hash_summaries[shape_key]
+            for hash_val, weight in other_hashes.weights.items():
+                self._track_hash(shape_key, hash_val, weight, other_hashes.errors[hash_val])
+                if self.detail:
+                    other_data = other.original_data[hash_val]
+                    hash_data = self.original_data.get(hash_val)
+                    if hash_data is None:
+                        self.original_data[hash_val] = {
+                            "query_shape": other_data["query_shape"],
+                            "metrics": list(other_data["metrics"]),
+                            "namespace": other_data["namespace"]
+                        }
+                    else:
+                        hash_data["metrics"].extend(other_data["metrics"])
+
+        self.other.merge(other.other)
+        self.evictions += other.evictions
+
+    @PROFILER.timed("finalize")
+    def finalize(self, limit: Optional[int] = None) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+        """Build `(results, shapes)` for the top `k` shapes, heaviest first, then "other".
+
+        Each result has a `topK` section with the ranking metric, the
+        estimated weight and its maximum overestimate (`lowConfidence` when
+        that error is a large share of the estimate), and how often hashes
+        of the shape were evicted from its summary.
+        """
+        scale = TOP_METRICS[self.metric][1]
+        ranked = self.summary.ranked()
+        reported = ranked[:self.k if limit is None else min(self.k, limit)]
+
+        results = {}
+        shapes = {}
+        for shape_id, shape_key in enumerate(reported, start=1):
+            accumulator = self.shapes[shape_key]
+            hashes = self.hash_summaries[shape_key].ranked()
+            info = shape_info(shape_key, accumulator.namespace, hashes, accumulator.predicates)
+            if self.detail:
+                info["original_data"] = {hash_val: self.original_data[hash_val] for hash_val in hashes}
+            shapes[shape_id] = info
+
+            estimate = self.summary.weights[shape_key]
+            error = self.summary.errors[shape_key]
+            result = accumulator.to_result()
+            result["topK"] = {
+                "metric": self.metric,
+                "other": False,
+                "estimate": estimate * scale,
+                "maxError": error * scale,
+                "lowConfidence": error > estimate * LOW_CONFIDENCE_ERROR,
+                "hashEvictions": self.hash_evictions.get(shape_key, 0),
+                "evictions": 0
+            }
+            results[shape_id] = result
+
+        below_top = ranked[len(reported):]
+        if (self.other.entry_count or below_top) and limit is None:
+            # Exact totals of everything not reported: what evicted shapes had
+            # accumulated while tracked, plus the tracked shapes below the top K
+            other = ShapeAccumulator()
+            other.merge(self.other)
+            for shape_key in below_top:
+                other.merge(self.shapes[shape_key])
+            other_id = len(reported) + 1
+            shapes[other_id] = {"field_names": [], "namespace": "", "hashes": []}
+            if self.detail:
+                shapes[other_id]["original_data"] = {}
+            result = other.to_result()
+            result["efficiency"]["indexCandidate"] = ""  # Mixes unrelated shapes
+            result["topK"] = {
+                "metric": self.metric,
+                "other": True,
+                "estimate": getattr(other, TOP_METRICS[self.metric][2]) * scale,
+                "maxError": 0.0,
+                "lowConfidence": False,
+                "hashEvictions": 0,
+                "evictions": self.evictions,
+                "belowTopK": len(below_top)
+            }
+            results[other_id] = result
+        return results, shapes
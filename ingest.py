@@ -0,0 +1,205 @@
+"""
+MongoDB Query Metrics Analyzer - Streaming Ingestion Module
+"""
+import glob
+import json
+import os
+from typing import Any, Dict, IO, Iterable, Iterator, List, Tuple
+
+from profiling import PROFILER
+
+CHUNK_SIZE = 1 << 20  # Characters read from the input per refill
+BATCH_KEYS = ("firstBatch", "nextBatch")  # Batches of aggregate and getMore replies
+DUMP_EXTENSIONS = (".json", ".ndjson", ".jsonl")
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# Values decoded, or decode errors raised, this close to the end of the buffer may
+# be cut off by the chunk edge (e.g. "1." of "1.5", or a truncated literal or \u
+# escape), so they trigger a refill
+_TRUNCATION_MARGIN = 16
+
+
+class _StreamReader:
+    """Incremental JSON reader over a text file object.
+
+    Keeps only the unconsumed tail of the input in memory, so arrays of
+    arbitrary length can be walked one element at a time.
+    """
+
+    def __init__(self, fp: IO[str], chunk_size: int = CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Read another chunk, dropping the consumed prefix of the buffer"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if PROFILER.enabled:
+            # Characters, which equal bytes for the ASCII JSON mongod emits
+            PROFILER.count("bytes_read", len(chunk))
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _error(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        """Consume the next non-whitespace character, which must be `char`"""
+        if self.peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode and consume one complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Anything else is a syntax error, reported without reading on
+                truncated = e.pos >= len(self.buf) - _TRUNCATION_MARGIN or e.msg.startswith("Unterminated string")
+                if truncated and self._fill():
+                    continue
+                raise
+            # A number ending near the buffer edge may be truncated ("1." of "1.5")
+            if end >= len(self.buf) - _TRUNCATION_MARGIN and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Iterate over the keys of the object at the cursor.
+
+        The caller must consume each member's value before asking for the
+        next key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise self._error("Expecting property name enclosed in double quotes")
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                self.pos -= 1
+                raise self._error("Expecting ',' delimiter")
+
+    def items(self) -> Iterator[Any]:
+        """Iterate over the elements of the array at the cursor"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                self.pos -= 1
+                raise self._error("Expecting ',' delimiter")
+
+
+def _iter_cursor(reader: _StreamReader) -> Iterator[Dict]:
+    """Stream the batch arrays of a `cursor` sub-document, skipping other members"""
+    for key in reader.members():
+        if key in BATCH_KEYS and reader.peek() == "[":
+            yield from reader.items()
+        else:
+            reader.value()
+
+
+def _iter_document(reader: _StreamReader) -> Iterator[Dict]:
+    """Stream the entries contained in one top-level JSON value.
+
+    A command reply (`{"cursor": {"firstBatch": [...]}, ...}`) has its batch
+    streamed element by element; an array yields its elements; any other
+    object is taken to be a single queryStats entry.
+    """
+    if reader.peek() == "[":
+        for item in reader.items():
+            if isinstance(item, dict):
+                yield item
+        return
+
+    # Decode members one at a time until we know whether this is a reply
+    # wrapping a cursor or a plain entry
+    members: List[Tuple[str, Any]] = []
+    is_reply = False
+    for key in reader.members():
+        if key == "cursor" and reader.peek() == "{":
+            is_reply = True
+            yield from _iter_cursor(reader)
+        else:
+            members.append((key, reader.value()))
+
+    if not is_reply:
+        yield dict(members)
+
+
+def iter_stream_entries(fp: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    """Yield queryStats entries from a text stream one at a time.
+
+    Accepts a `$queryStats` command reply (entries in `cursor.firstBatch`,
+    or `cursor.nextBatch` for a saved getMore reply), a bare JSON array of
+    entries, or newline-delimited JSON with one entry (or one reply) per
+    line.
+    """
+    reader = _StreamReader(fp, chunk_size)
+    while reader.peek():
+        yield from _iter_document(reader)
+
+
+def iter_batch_entries(path: str) -> Iterator[Dict]:
+    """Yield queryStats entries from the file at `path` one at a time"""
+    with open(path, 'r', encoding='utf-8') as file:
+        yield from iter_stream_entries(file)
+
+
+def expand_input_paths(inputs: Iterable[str]) -> List[str]:
+    """Expand files, directories and glob patterns into a list of dump files.
+
+    Directories contribute their `.json`/`.ndjson`/`.jsonl` files in sorted
+    order; duplicates are dropped while preserving the order given.
+    """
+    paths: Dict[str, None] = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                path = os.path.join(item, name)
+                if name.endswith(DUMP_EXTENSIONS) and os.path.isfile(path):
+                    paths[path] = None
+        elif glob.has_magic(item):
+            for path in sorted(glob.glob(item)):
+                if os.path.isfile(path):
+                    paths[path] = None
+        else:
+            paths[item] = None
+    return list(paths)
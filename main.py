@@ -4,65 +4,333 @@ MongoDB Query Metrics Analyzer - Main Entry Point
 """
 import json
 import argparse
-import threading
+import cProfile
+import functools
+import itertools
 import time
+import tracemalloc
 import webbrowser
 
-from analyzer import analyze_metrics
-from console_output import print_console_tables
-from web_server import create_web_server, create_templates
+from analyzer import (analyze_files, analyze_metrics, configure_grouping, configure_shape_cache, parse_group_by,
+                      shape_cache_info, MetricsAggregator, GROUP_KEYS, SHAPE_CACHE_SIZE)
+from background import BackgroundAnalysis
+from delta import diff_entries
+from export import Exporter, EXPORT_FORMATS
+from heavy_hitters import TopKAggregator, TOP_METRICS
+from ingest import expand_input_paths, iter_batch_entries
+from profiling import PROFILER, format_report
+from snapshot import load_snapshot, save_snapshot
+from console_output import print_console_tables, print_diff_tables
+from watch import DumpWatcher
+from web_server import create_web_server, create_templates, refresh_web_server, start_web_server
+
+def print_cache_stats():
+    """Print hit/miss statistics of the shape extraction cache"""
+    info = shape_cache_info()
+    lookups = info.hits + info.misses
+    hit_rate = 100.0 * info.hits / lookups if lookups else 0.0
+    print(f"Shape cache: {info.hits} hits, {info.misses} misses ({hit_rate:.1f}% hit rate), "
+          f"{info.currsize}/{info.maxsize} entries")
+
+def start_profiling(args):
+    """Enable the instrumentation requested on the command line; returns the cProfile profiler, if any"""
+    if args.profile:
+        PROFILER.enable()
+    if args.tracemalloc:
+        tracemalloc.start(25)
+    if args.cprofile:
+        cpu_profiler = cProfile.Profile()
+        cpu_profiler.enable()
+        return cpu_profiler
+    return None
+
+def finish_profiling(args, cpu_profiler):
+    """Write the cProfile/tracemalloc captures and print the phase report"""
+    if cpu_profiler is not None:
+        cpu_profiler.disable()
+        cpu_profiler.dump_stats(args.cprofile)
+        print(f"Wrote cProfile statistics to '{args.cprofile}' (inspect with: python -m pstats {args.cprofile}).")
+    if args.tracemalloc and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot.dump(args.tracemalloc)
+        print(f"Wrote tracemalloc snapshot to '{args.tracemalloc}' (load with tracemalloc.Snapshot.load).")
+        if args.profile:
+            print("Top allocations:")
+            for stat in snapshot.statistics("lineno")[:10]:
+                print(f"  {stat}")
+    if args.profile:
+        print(format_report(PROFILER.report()))
+
+def watch_for_updates(watcher, interval, publish):
+    """Poll for new queryStats data every `interval` seconds and publish refreshed results"""
+    while True:
+        time.sleep(interval)
+        count = watcher.poll()
+        if count:
+            print(f"Ingested {count} new entries.")
+            publish(*watcher.aggregator.finalize())
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='MongoDB Query Metrics Analyzer')
-    parser.add_argument('file', help='JSON file to analyze')
+    parser.add_argument('files', nargs='*',
+                        help='JSON or newline-delimited JSON files, directories or glob patterns to analyze')
     parser.add_argument('--web', action='store_true', help='Display results in web browser')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes for multi-file input (default: one per CPU)')
+    parser.add_argument('--shape-cache-size', type=int, default=SHAPE_CACHE_SIZE,
+                        help=f'Maximum query shapes kept in the shape extraction cache (default: {SHAPE_CACHE_SIZE})')
+    parser.add_argument('--group-by', default='fields', metavar='KEYS',
+                        help='Comma-separated components grouping entries into shapes '
+                             f'(from: {", ".join(GROUP_KEYS)}; default: fields)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print analysis statistics')
+    parser.add_argument('--save-snapshot', metavar='PATH', help='Save the analysis to a binary snapshot file')
+    parser.add_argument('--load-snapshot', metavar='PATH', help='Reopen a saved snapshot instead of analyzing files')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep watching the inputs and ingest new dumps or appended lines as they arrive')
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='Seconds between checks for new data in --watch mode (default: 60)')
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help='Statistics engine; numpy is the latency statistics engine, adding latency stddev, '
+                             'min/max and percentiles at about the speed of python (default: python)')
+    parser.add_argument('--diff', action='store_true',
+                        help='Compare two dumps (OLD NEW) and report per-shape activity in between')
+    parser.add_argument('--diff-seconds', type=float, default=None,
+                        help='Interval length for --diff rates (default: derived from the entries\' asOf times)')
+    parser.add_argument('--uri', help='Run $queryStats on this MongoDB deployment instead of reading files')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Entries fetched per cursor batch with --uri (default: 1000)')
+    parser.add_argument('--top-k', type=int, default=None, metavar='K',
+                        help='Report only the K heaviest shapes, tracked in bounded memory, '
+                             'rolling the rest into "Other"')
+    parser.add_argument('--top-metric', choices=list(TOP_METRICS), default='totalExecMillis',
+                        help='Metric ranking the shapes in --top-k mode (default: totalExecMillis)')
+    parser.add_argument('--export', metavar='DIR',
+                        help='Write per-entry, per-hash and per-shape tables to DIR (streams input files serially)')
+    parser.add_argument('--export-format', choices=list(EXPORT_FORMATS), default=None,
+                        help='Format of --export tables (default: parquet if pyarrow is installed, else csv)')
+    parser.add_argument('--fetch-assets', action='store_true',
+                        help='Download the JavaScript/CSS of the web UI into static/vendor, checked against the '
+                             'digests in static/vendor-integrity.json, and exit. Pages otherwise load them from '
+                             'public CDNs, so for hosts without internet access run this on a connected machine '
+                             'and copy static/vendor over')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each phase (parse, shape extraction, aggregation, rendering) and print a report')
+    parser.add_argument('--cprofile', metavar='PATH', help='Write cProfile statistics of the analysis to PATH')
+    parser.add_argument('--tracemalloc', metavar='PATH',
+                        help='Trace memory allocations during the analysis and write the snapshot to PATH')
     args = parser.parse_args()
     
-    # Load JSON data from file
+    if args.fetch_assets:
+        from assets import fetch_assets
+        try:
+            written = fetch_assets()
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not fetch the web UI assets: {e}")
+            return
+        print(f"Vendored {len(written)} asset files" if written else "Web UI assets are already vendored")
+        return
+    if not args.files and not args.load_snapshot and not args.uri:
+        parser.error('at least one input file, --uri or --load-snapshot is required')
+    if args.uri and (args.files or args.load_snapshot or args.watch or args.diff):
+        parser.error('--uri cannot be combined with input files, --load-snapshot, --watch or --diff')
+    if args.top_k is not None and (args.top_k < 1 or args.watch or args.diff or args.load_snapshot
+                                   or args.engine != 'python'):
+        parser.error('--top-k takes a positive K and works with file or --uri input and the python engine')
+    if args.export and (args.watch or args.diff or args.load_snapshot):
+        parser.error('--export works with file or --uri input, not --watch, --diff or --load-snapshot')
     try:
-        with open(args.file, 'r') as file:
-            data = json.load(file)
+        group_by = parse_group_by(args.group_by)
+    except ValueError as e:
+        parser.error(f'--group-by: {e}')
+    if args.load_snapshot and group_by != ('fields',):
+        parser.error('--group-by cannot regroup a snapshot (use the roll-up view of the web UI)')
+    configure_grouping(group_by)
+    if args.watch and args.load_snapshot:
+        parser.error('--watch cannot be combined with --load-snapshot')
+    if args.diff and (len(args.files) != 2 or args.watch or args.load_snapshot):
+        parser.error('--diff takes exactly two input files (OLD NEW)')
+    
+    watcher = None
+    background_paths = None
+    factory = None
+    exporter = None
+    cpu_profiler = start_profiling(args)
+    analysis_started = time.perf_counter()
+    try:
+        if args.export:
+            exporter = Exporter(args.export, args.export_format)
+        
+        if args.watch:
+            # Track entries so re-read cumulative counters replace earlier readings
+            configure_shape_cache(args.shape_cache_size)
+            aggregator = MetricsAggregator(detail=args.web or bool(args.save_snapshot), track_entries=True)
+            watcher = DumpWatcher(args.files, aggregator)
+            watcher.poll()
+            results, shapes = aggregator.finalize()
+        elif args.diff:
+            # Join the newer dump against an index of the older one in a single pass
+            configure_shape_cache(args.shape_cache_size)
+            results, shapes, interval_seconds = diff_entries(
+                iter_batch_entries(args.files[0]), iter_batch_entries(args.files[1]),
+                detail=args.web or bool(args.save_snapshot), interval_seconds=args.diff_seconds)
+        elif args.load_snapshot:
+            results, shapes = load_snapshot(args.load_snapshot)
+        elif args.uri:
+            # Aggregate entries while later cursor batches are still being fetched
+            from mongo_source import connect, iter_query_stats
+            configure_shape_cache(args.shape_cache_size)
+            detail = args.web or bool(args.save_snapshot)
+            if args.top_k:
+                factory = functools.partial(TopKAggregator, args.top_k, args.top_metric, detail)
+            client = connect(args.uri)
+            try:
+                entries = iter_query_stats(client, batch_size=args.batch_size)
+                if exporter is not None:
+                    entries = exporter.tee(entries)
+                if args.engine == 'numpy':
+                    from numpy_engine import analyze_metrics_numpy
+                    results, shapes = analyze_metrics_numpy(entries, detail=detail)
+                elif factory:
+                    aggregator = factory()
+                    aggregator.add_all(entries)
+                    results, shapes = aggregator.finalize()
+                else:
+                    results, shapes = analyze_metrics(entries, detail=detail)
+            finally:
+                client.close()
+            
+            if args.verbose:
+                print_cache_stats()
+        else:
+            # Stream entries from every input file into the analyzer
+            paths = expand_input_paths(args.files)
+            if not paths:
+                print("Error: No input files found.")
+                return
+            
+            # Per-hash drill-down data is only needed by the web UI and snapshots
+            configure_shape_cache(args.shape_cache_size)
+            detail = args.web or bool(args.save_snapshot)
+            if args.top_k:
+                # Bounded memory whatever the number of distinct shapes (see heavy_hitters)
+                factory = functools.partial(TopKAggregator, args.top_k, args.top_metric, detail)
+            if args.engine == 'numpy':
+                from numpy_engine import analyze_metrics_numpy
+                entries = itertools.chain.from_iterable(iter_batch_entries(path) for path in paths)
+                if exporter is not None:
+                    entries = exporter.tee(entries)
+                results, shapes = analyze_metrics_numpy(entries, detail=detail)
+            elif exporter is not None:
+                # Entries are recorded as they pass, so they are streamed here rather than in worker processes
+                aggregator = factory() if factory else MetricsAggregator(detail=detail)
+                aggregator.add_all(exporter.tee(
+                    itertools.chain.from_iterable(iter_batch_entries(path) for path in paths)))
+                results, shapes = aggregator.finalize()
+            elif args.web and not args.cprofile:
+                # Serve the UI right away and analyze in the background (see below);
+                # cProfile only sees this thread, so --cprofile keeps the analysis here
+                results, shapes = {}, {}
+                background_paths = paths
+            else:
+                results, shapes = analyze_files(paths, detail=detail, workers=args.workers, factory=factory)
+            
+            if args.verbose and background_paths is None:
+                print_cache_stats()
+        
+        def analysis_complete(results, shapes):
+            """Record, save and report the full results of an analysis"""
+            if PROFILER.enabled:
+                PROFILER.add_time("analyze", time.perf_counter() - analysis_started)
+            if args.save_snapshot:
+                save_snapshot(args.save_snapshot, results, shapes)
+                print(f"Saved analysis snapshot to '{args.save_snapshot}'.")
+            if exporter is not None:
+                exporter.finish(results, shapes)
+                print(f"Exported {exporter.entry_count} entries, {exporter.hash_count} hashes and "
+                      f"{exporter.shape_count} shapes to '{args.export}' ({exporter.format}).")
+        
+        def background_complete(results, shapes):
+            """Finish up once the background analysis has published its full results"""
+            print(f"Analysis complete: {len(results)} query shapes.")
+            if args.verbose:
+                print_cache_stats()
+            analysis_complete(results, shapes)
+            finish_profiling(args, cpu_profiler)
         
-        # Analyze the metrics
-        results, shapes = analyze_metrics(data)
+        if background_paths is None:
+            analysis_complete(results, shapes)
+        
+        app = None
+        
+        def publish(results, shapes):
+            """Show results refreshed by watch mode"""
+            if args.save_snapshot:
+                save_snapshot(args.save_snapshot, results, shapes)
+            if app is not None:
+                refresh_web_server(app, results, shapes)
+            else:
+                print_console_tables(results, shapes)
         
         # Print to console if web option is not selected
         if not args.web:
-            print_console_tables(results, shapes)
+            if args.diff:
+                print_diff_tables(results, shapes, interval_seconds)
+            else:
+                print_console_tables(results, shapes)
+            finish_profiling(args, cpu_profiler)
+            
+            if watcher:
+                try:
+                    watch_for_updates(watcher, args.interval, publish)
+                except KeyboardInterrupt:
+                    print("\nExiting...")
         else:
             # Create HTML templates and initialize the web server
             create_templates()
-            app = create_web_server(results, shapes)
-            
-            # Start Flask app in a separate thread
-            flask_thread = threading.Thread(target=lambda: app.run(debug=False, port=5000))
-            flask_thread.daemon = True
-            flask_thread.start()
+            analysis = None
+            if background_paths is not None:
+                analysis = BackgroundAnalysis(
+                    background_paths, lambda results, shapes: refresh_web_server(app, results, shapes),
+                    detail=detail, workers=args.workers, on_complete=background_complete, factory=factory)
+            app = create_web_server(results, shapes, analysis.progress if analysis else None)
+            if analysis:
+                analysis.start()
+                print(f"Analyzing {len(background_paths)} file(s) in the background; "
+                      "partial results are shown as they arrive.")
+            else:
+                finish_profiling(args, cpu_profiler)
             
-            # Open browser
-            time.sleep(1)
-            webbrowser.open('http://localhost:5000')
+            # The server is listening once started, so the browser can be opened right away
+            start_web_server(app, port=5000)
+            webbrowser.open('http://localhost:5000/diff' if args.diff else 'http://localhost:5000')
             
             print("Opening web browser. Press Ctrl+C to exit.")
             
-            # Keep the main thread running
+            # Keep the main thread running, refreshing the app in watch mode
             try:
+                if watcher:
+                    watch_for_updates(watcher, args.interval, publish)
                 while True:
                     time.sleep(1)
             except KeyboardInterrupt:
                 print("\nExiting...")
     
-    except FileNotFoundError:
-        print(f"Error: File '{args.file}' not found.")
+    except FileNotFoundError as e:
+        print(f"Error: File '{e.filename}' not found.")
     except json.JSONDecodeError:
         print("Error: Invalid JSON format in the input file.")
     except ImportError as e:
         print(f"Error: Missing required package: {str(e)}.")
         print("Please install required packages:")
-        print("pip install prettytable flask")
+        print("pip install prettytable flask (plus numpy for --engine numpy, pymongo for --uri, "
+              "pyarrow for --export-format parquet/arrow)")
     except Exception as e:
         print(f"Error: {str(e)}")
+    finally:
+        if exporter is not None:
+            exporter.close()
 
 if __name__ == "__main__":
     main()
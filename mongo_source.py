@@ -0,0 +1,164 @@
+"""
+MongoDB Query Metrics Analyzer - MongoDB Source Module
+
+Runs `$queryStats` against a live deployment instead of reading a saved
+dump. The cursor is drained batch by batch (`aggregate`, then `getMore`
+until the cursor is exhausted) on a background thread that stays a few
+batches ahead of the consumer, so network round trips overlap with
+aggregation.
+"""
+import operator
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from profiling import PROFILER
+
+BATCH_SIZE = 1000  # Entries requested per aggregate/getMore round trip
+PREFETCH_BATCHES = 4  # Batches fetched ahead of the consumer
+MAX_POOL_SIZE = 4
+APP_NAME = "mongo-query-metrics-analyzer"
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+_PLAIN_SCALARS = frozenset(_JSON_SCALARS)
+_END = object()
+
+
+def connect(uri: str, **options) -> Any:
+    """Create a pooled pymongo client for `uri` (requires the pymongo package)"""
+    from pymongo import MongoClient
+
+    options.setdefault("maxPoolSize", MAX_POOL_SIZE)
+    options.setdefault("appname", APP_NAME)
+    return MongoClient(uri, **options)
+
+
+def _to_json_compatible(value: Any) -> Any:
+    """Convert BSON values (dates, Decimal128, ...) to the extended JSON a saved dump would hold.
+
+    Containers are only copied when something inside them changes, so
+    data that is already JSON-compatible is returned as it is.
+    """
+    if value.__class__ in _PLAIN_SCALARS:
+        return value
+    if value.__class__ is dict:
+        converted = None
+        for key, item in value.items():
+            new_item = _to_json_compatible(item)
+            if new_item is not item:
+                if converted is None:
+                    converted = dict(value)
+                converted[key] = new_item
+        return value if converted is None else converted
+    if value.__class__ is list:
+        items = [_to_json_compatible(item) for item in value]
+        return value if all(map(operator.is_, items, value)) else items
+    if isinstance(value, _JSON_SCALARS):  # e.g. bson.Int64
+        return value
+    from bson import json_util
+
+    return json_util.default(value, json_util.RELAXED_JSON_OPTIONS)
+
+
+def _convert_entry(entry: Dict) -> Dict:
+    """Make an entry JSON-compatible.
+
+    Only `asOf` and the metrics (timestamps, Decimal128 sums of squares)
+    carry BSON-specific types; `key` holds the query shape, whose literals
+    the server has already replaced by type placeholders, so it is passed
+    through without walking it.
+    """
+    return {name: value if name == "key" else _to_json_compatible(value) for name, value in entry.items()}
+
+
+def iter_query_stats_batches(client: Any, batch_size: int = BATCH_SIZE,
+                             query_stats_options: Optional[Dict] = None) -> Iterator[List[Dict]]:
+    """Yield the raw batches of a `$queryStats` cursor.
+
+    Speaks the cursor protocol with plain commands on the `admin` database,
+    so `client` may be a pymongo MongoClient or any object providing
+    `client.admin.command(...)` (e.g. a mock server for tests). The cursor
+    is killed if the consumer stops early.
+    """
+    admin = client.admin
+    reply = admin.command({
+        "aggregate": 1,
+        "pipeline": [{"$queryStats": query_stats_options or {}}],
+        "cursor": {"batchSize": batch_size},
+    })
+    cursor = reply["cursor"]
+    cursor_id = cursor.get("id", 0)
+    collection = cursor.get("ns", "admin.$cmd.aggregate").split(".", 1)[1]
+    try:
+        yield cursor.get("firstBatch", [])
+        while cursor_id:
+            reply = admin.command({"getMore": cursor_id, "collection": collection, "batchSize": batch_size})
+            cursor = reply["cursor"]
+            cursor_id = cursor.get("id", 0)
+            yield cursor.get("nextBatch", [])
+    finally:
+        if cursor_id:
+            admin.command({"killCursors": collection, "cursors": [cursor_id]})
+
+
+class _BatchPrefetcher(threading.Thread):
+    """Background thread draining a batch iterator into a bounded queue"""
+
+    def __init__(self, batches: Iterator[List[Dict]], prefetch: int):
+        super().__init__(name="queryStats-fetch", daemon=True)
+        self.batches = batches
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(prefetch, 1))
+        self.stopped = threading.Event()
+
+    def _put(self, item: Any) -> bool:
+        """Hand an item to the consumer, giving up once the consumer has stopped"""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                start = time.perf_counter()
+                batch = next(self.batches, None)
+                if batch is None:
+                    break
+                if PROFILER.enabled:
+                    PROFILER.add_time("fetch", time.perf_counter() - start)
+                    PROFILER.count("batches")
+                if not self._put([_convert_entry(entry) for entry in batch]):
+                    break
+        except Exception as e:
+            self._put(e)
+        finally:
+            # Runs the cursor's cleanup (killCursors) on this thread
+            self.batches.close()
+        self._put(_END)
+
+
+def iter_query_stats(client: Any, batch_size: int = BATCH_SIZE, prefetch: int = PREFETCH_BATCHES,
+                     query_stats_options: Optional[Dict] = None) -> Iterator[Dict]:
+    """Yield `$queryStats` entries from a live deployment one at a time.
+
+    Batches are fetched up to `prefetch` ahead of the consumer on a
+    background thread; errors raised while fetching are re-raised here.
+    Entries have BSON-specific values converted to extended JSON, so they
+    can be analyzed, saved and served exactly like entries read from a dump.
+    """
+    prefetcher = _BatchPrefetcher(iter_query_stats_batches(client, batch_size, query_stats_options), prefetch)
+    prefetcher.start()
+    try:
+        while True:
+            item = prefetcher.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        prefetcher.stopped.set()
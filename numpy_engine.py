@@ -0,0 +1,346 @@
+"""
+MongoDB Query Metrics Analyzer - NumPy Statistics Engine
+
+A latency statistics engine: besides the standard results of
+analyzer.analyze_metrics it reports the latency distribution of each shape
+(`latencyMillis`). Per-entry metrics are gathered into columnar arrays in
+batches and every per-shape statistic is computed with grouped vectorized
+operations. It reads about twice as many metrics per entry as the default
+accumulator engine, so it runs at roughly the same speed rather than
+faster; use it for the extra statistics.
+"""
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from analyzer import extract_match_shape, iter_entries, shape_info
+from efficiency import IndexPredicates, efficiency_scores
+from profiling import PROFILER
+
+PERCENTILES = (50, 95, 99)
+LATENCY_STATISTICS = ("mean", "stddev", "min", "max", "firstResponse") + tuple(f"p{q}" for q in PERCENTILES)
+
+COLUMN_BATCH = 65536  # Entries converted to columns at a time
+COLUMN_NAMES = ("shape", "exec_count", "total_exec", "min_exec", "max_exec", "sum_of_squares",
+                "first_response", "docs_returned", "keys_examined", "docs_examined")
+
+_NAN = float("nan")
+_PLAIN_NUMBERS = frozenset((int, float))
+_EMPTY: Dict = {}
+
+
+def _number(value) -> float:
+    """Numeric value of a metric field, unwrapping extended JSON ($numberLong, $numberDecimal, ...)"""
+    if value.__class__ in _PLAIN_NUMBERS:
+        return value
+    if isinstance(value, dict):
+        for wrapped in value.values():
+            return float(wrapped)
+        return _NAN
+    if value is None:
+        return _NAN
+    return float(value)
+
+
+def _integer(value) -> int:
+    """Integer value of a counter field (0 when absent)"""
+    if value.__class__ is int:
+        return value
+    number = _number(value)
+    return int(number) if number == number else 0
+
+
+class _Columns:
+    """Per-entry metric columns, built in batches with vectorized conversions.
+
+    Ingestion only records each entry's hash position and metrics; every
+    COLUMN_BATCH entries the metrics are turned into NumPy columns at once,
+    so the per-entry Python work stays minimal and memory stays bounded.
+    """
+
+    def __init__(self):
+        self.positions: List[int] = []  # Hash position of each pending entry
+        self.pending: List[Dict] = []
+        self.batches: Dict[str, List[np.ndarray]] = {name: [] for name in COLUMN_NAMES}
+
+    def flush(self, hash_shapes: List[int]):
+        """Convert the pending entries into a batch of every column (`hash_shapes` maps positions to shapes)"""
+        pending = self.pending
+        if not pending:
+            return
+        batches = self.batches
+        batches["shape"].append(np.array(hash_shapes, dtype=np.int64)[np.array(self.positions, dtype=np.int64)])
+        batches["exec_count"].append(_int_column(pending, "execCount"))
+
+        total_exec = _float_columns(_sub_documents(pending, "totalExecMicros"),
+                                    ("sum", "min", "max", "sumOfSquares"))
+        for position, name in enumerate(("total_exec", "min_exec", "max_exec", "sum_of_squares")):
+            batches[name].append(total_exec[:, position])
+        batches["first_response"].append(
+            _float_columns(_sub_documents(pending, "firstResponseExecMicros"), ("sum",))[:, 0])
+        for name, metric in (("docs_returned", "docsReturned"), ("keys_examined", "keysExamined"),
+                             ("docs_examined", "docsExamined")):
+            batches[name].append(_int_column(_sub_documents(pending, metric), "sum"))
+        self.positions = []
+        self.pending = []
+
+    def column(self, name: str) -> np.ndarray:
+        """Every batch of a column concatenated (call flush() first)"""
+        batches = self.batches[name]
+        return np.concatenate(batches) if batches else np.zeros(0)
+
+
+# Each column is first read with C-level item lookups; documents missing a
+# field or holding extended JSON values take the per-value slow path.
+
+def _sub_documents(documents: List[Dict], name: str) -> List:
+    """The `name` sub-document (e.g. `{sum, min, max}`) of each entry, None when absent"""
+    try:
+        return list(map(itemgetter(name), documents))
+    except KeyError:
+        return [document.get(name) for document in documents]
+
+
+def _float_columns(documents: List, fields: Tuple[str, ...]) -> np.ndarray:
+    """`fields` of each document as a float matrix (one column per field), NaN when absent"""
+    try:
+        values = chain.from_iterable(map(itemgetter(*fields), documents)) if len(fields) > 1 else \
+            map(itemgetter(fields[0]), documents)
+        matrix = np.fromiter(values, np.float64, count=len(documents) * len(fields))
+    except (KeyError, TypeError, ValueError):
+        matrix = np.array([_number(document.get(field)) if document.__class__ is dict else _NAN
+                           for document in documents for field in fields], dtype=np.float64)
+    return matrix.reshape(len(documents), len(fields))
+
+
+def _int_column(documents: List, field: str) -> np.ndarray:
+    """`field` of each document as integer counters, 0 when absent"""
+    try:
+        return np.fromiter(map(itemgetter(field), documents), np.int64, count=len(documents))
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return np.array([_integer(document.get(field)) if document.__class__ is dict else 0
+                         for document in documents], dtype=np.int64)
+
+
+def _weighted_percentiles(groups: np.ndarray, values: np.ndarray, weights: np.ndarray,
+                          starts: np.ndarray, ends: np.ndarray, quantile: float) -> np.ndarray:
+    """Weighted quantile of `values` within each group, for all groups at once.
+
+    Rows must be sorted by (group, value). For every group, returns the
+    first value whose cumulative weight reaches `quantile` of the group's
+    total weight (NaN for groups with no weight).
+    """
+    cumulative = np.cumsum(weights)
+    before = np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0.0)
+    totals = cumulative[ends - 1] - before
+    targets = before + quantile * totals
+    positions = np.searchsorted(cumulative, targets, side="left")
+    positions = np.clip(positions, starts, ends - 1)
+    result = values[positions]
+    result[totals <= 0] = np.nan
+    return result
+
+
+def analyze_metrics_numpy(data: Union[Dict, Iterable[Dict]], detail: bool = True) -> tuple:
+    """Analyze metrics like analyze_metrics, computing statistics with NumPy.
+
+    Each shape's result additionally contains `latencyMillis` with the
+    exec-weighted mean, standard deviation (from `sumOfSquares`), min and
+    max of per-execution latency, and p50/p95/p99 estimates obtained by
+    weighting each entry's average latency by its execution count.
+    """
+    shape_index: Dict[tuple, int] = {}
+    shape_keys: List[tuple] = []
+    shape_namespaces = []
+    shape_hashes: List[Dict[str, None]] = []
+    shape_predicates: List[IndexPredicates] = []
+    original_data: Dict[str, Dict] = {}
+    columns = _Columns()
+    positions = columns.positions
+    pending = columns.pending
+
+    # Shape grouping is resolved once per queryShapeHash; entries only record their hash position
+    hash_index: Dict[str, int] = {}
+    hash_shapes: List[int] = []  # Hash position -> shape position
+
+    for batch in iter_entries(data):
+        metrics = batch.get("metrics")
+        if metrics is None:
+            continue
+        hash_position = hash_index.get(batch.get("queryShapeHash"))
+        if hash_position is None:
+            query_shape_hash, shape_key, namespace, predicates = extract_match_shape(batch)
+            if not query_shape_hash:
+                continue
+            position = shape_index.get(shape_key)
+            if position is None:
+                position = shape_index[shape_key] = len(shape_keys)
+                shape_keys.append(shape_key)
+                shape_namespaces.append(namespace)
+                shape_hashes.append({})
+                shape_predicates.append(IndexPredicates())
+            shape_hashes[position][query_shape_hash] = None
+            shape_predicates[position].add(*predicates)
+            hash_position = hash_index[query_shape_hash] = len(hash_shapes)
+            hash_shapes.append(position)
+            if detail:
+                original_data[query_shape_hash] = {
+                    "query_shape": batch.get("key", {}).get("queryShape", {}),
+                    "metrics": [],
+                    "namespace": namespace
+                }
+        positions.append(hash_position)
+        pending.append(metrics)
+        if len(pending) >= COLUMN_BATCH:
+            columns.flush(hash_shapes)
+            positions = columns.positions
+            pending = columns.pending
+
+        if detail:
+            original_data[batch["queryShapeHash"]]["metrics"].append(metrics)
+
+    results: Dict[int, Dict] = {}
+    shapes: Dict[int, Dict] = {}
+    if not shape_keys:
+        return results, shapes
+
+    columns.flush(hash_shapes)
+    PROFILER.set("shapes", len(shape_keys))
+    with PROFILER.phase("statistics"):
+        stats = _grouped_statistics(columns, len(shape_keys))
+    for position, shape_key in enumerate(shape_keys):
+        shape_id = position + 1
+        hashes = list(shape_hashes[position])
+        info = shape_info(shape_key, shape_namespaces[position], hashes, shape_predicates[position])
+        if detail:
+            info["original_data"] = {hash_val: original_data[hash_val] for hash_val in hashes}
+        shapes[shape_id] = info
+        results[shape_id] = _result(stats, position)
+        results[shape_id]["efficiency"]["indexCandidate"] = shape_predicates[position].candidate()
+
+    return results, shapes
+
+
+def _grouped_statistics(columns: _Columns, shape_count: int) -> Dict[str, List]:
+    """Compute every per-shape statistic from the entry columns"""
+    shape = columns.column("shape")
+    PROFILER.count("entries", len(shape))
+    order = np.argsort(shape, kind="stable")
+    groups = shape[order]
+    counts = np.bincount(groups, minlength=shape_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ends = starts + counts
+
+    def sorted_column(name: str) -> np.ndarray:
+        return columns.column(name)[order]
+
+    exec_count = sorted_column("exec_count")
+    total_exec = sorted_column("total_exec")
+    has_total = ~np.isnan(total_exec)
+    total_exec_filled = np.where(has_total, total_exec, 0.0)
+
+    def group_sum(values: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(values, starts)
+
+    # Mean of per-entry average exec times, as in the pure-Python engine
+    averaged = has_total & (exec_count > 0)
+    entry_avg_ms = np.where(averaged, total_exec_filled / np.maximum(exec_count, 1) / 1000.0, 0.0)
+    avg_count = group_sum(averaged.astype(np.int64))
+    avg_of_avgs = np.divide(group_sum(entry_avg_ms), avg_count,
+                            out=np.zeros(shape_count), where=avg_count > 0)
+
+    # Per-execution latency distribution
+    exec_total = group_sum(exec_count)
+    timed_execs = group_sum(np.where(has_total, exec_count, 0))
+    total_exec_sum = group_sum(total_exec_filled)
+    mean_micros = np.divide(total_exec_sum, timed_execs, out=np.full(shape_count, np.nan), where=timed_execs > 0)
+
+    sum_of_squares = sorted_column("sum_of_squares")
+    has_squares = ~np.isnan(sum_of_squares) & has_total
+    squares_execs = group_sum(np.where(has_squares, exec_count, 0))
+    squares_sum = group_sum(np.where(has_squares, sum_of_squares, 0.0))
+    squares_total = group_sum(np.where(has_squares, total_exec_filled, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        squares_mean = squares_total / squares_execs
+        variance = squares_sum / squares_execs - squares_mean ** 2
+    stddev_micros = np.where(squares_execs > 0, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+    min_micros = np.fmin.reduceat(sorted_column("min_exec"), starts)
+    max_micros = np.fmax.reduceat(sorted_column("max_exec"), starts)
+
+    first_response = sorted_column("first_response")
+    has_first = ~np.isnan(first_response)
+    first_execs = group_sum(np.where(has_first, exec_count, 0))
+    first_response_micros = np.divide(group_sum(np.where(has_first, first_response, 0.0)), first_execs,
+                                      out=np.full(shape_count, np.nan), where=first_execs > 0)
+
+    # Weighted percentiles of per-entry mean latency, weighted by execCount
+    weights = np.where(averaged, exec_count, 0).astype(np.float64)
+    within = np.lexsort((entry_avg_ms, groups))
+    percentiles = {
+        quantile: _weighted_percentiles(groups[within], entry_avg_ms[within], weights[within], starts, ends,
+                                        quantile / 100.0)
+        for quantile in PERCENTILES
+    }
+
+    return {
+        "entries": counts.tolist(),
+        "exec_count": exec_total.tolist(),
+        "avg_of_avgs": avg_of_avgs.tolist(),
+        "total_exec_micros": total_exec_sum.tolist(),
+        "docs_returned": group_sum(sorted_column("docs_returned")).tolist(),
+        "keys_examined": group_sum(sorted_column("keys_examined")).tolist(),
+        "docs_examined": group_sum(sorted_column("docs_examined")).tolist(),
+        "mean": (mean_micros / 1000.0).tolist(),
+        "stddev": (stddev_micros / 1000.0).tolist(),
+        "min": (min_micros / 1000.0).tolist(),
+        "max": (max_micros / 1000.0).tolist(),
+        "firstResponse": (first_response_micros / 1000.0).tolist(),
+        **{f"p{quantile}": values.tolist() for quantile, values in percentiles.items()},
+    }
+
+
+def _result(stats: Dict[str, List], position: int) -> Dict:
+    """Per-shape result dict in the analyze_metrics format plus `latencyMillis`"""
+    count = stats["entries"][position]
+    total_exec_micros = stats["total_exec_micros"][position]
+    docs_returned = stats["docs_returned"][position]
+    keys_examined = stats["keys_examined"][position]
+    docs_examined = stats["docs_examined"][position]
+    return {
+        "shapes_count": count,
+        "execCount": {
+            "total": stats["exec_count"][position]
+        },
+        "avgExecMillis": {
+            "avg": stats["avg_of_avgs"][position]
+        },
+        "totalExecMillis": {
+            "avg": total_exec_micros / 1000.0 / count if count else 0,
+            "total": total_exec_micros / 1000.0
+        },
+        "docsReturned": {
+            "avg": docs_returned / count if count else 0,
+            "total": docs_returned
+        },
+        "keysExamined": {
+            "avg": keys_examined / count if count else 0,
+            "total": keys_examined
+        },
+        "docsExamined": {
+            "avg": docs_examined / count if count else 0,
+            "total": docs_examined
+        },
+        "efficiency": efficiency_scores(total_exec_micros, docs_returned, keys_examined, docs_examined),
+        "latencyMillis": {
+            name: _finite(stats[name][position])
+            for name in LATENCY_STATISTICS
+        }
+    }
+
+
+def _finite(value: float) -> float:
+    """Report unavailable statistics (NaN) as 0 so results stay JSON-serializable"""
+    return value if value == value else 0.0
@@ -0,0 +1,144 @@
+"""
+MongoDB Query Metrics Analyzer - Profiling Module
+
+Phase timers and counters for the hot paths (parsing, shape extraction,
+aggregation, rendering, API requests). Instrumentation is off by default
+and costs a single attribute check per entry until PROFILER.enable() is
+called.
+"""
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_bytes(children: bool = False) -> int:
+    """Peak resident set size of this process (0 when unavailable).
+
+    With `children`, the peak of the largest child process that has
+    exited and been waited for, e.g. the workers of a finished pool.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    """Accumulates wall time per named phase and named counters"""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        with self._lock:
+            self.phases.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set(self, counter: str, value: int):
+        """Record the current value of a gauge (e.g. the number of shapes)"""
+        with self._lock:
+            self.counters[counter] = value
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as `name` (a no-op unless enabled)"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name: str) -> Callable:
+        """Decorator timing every call of a function as phase `name`"""
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add_time(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict:
+        """Raw phases and counters, e.g. to ship from a worker process"""
+        with self._lock:
+            return {"phases": dict(self.phases), "counters": dict(self.counters)}
+
+    def merge(self, snapshot: Dict):
+        """Add the phases and counters of another snapshot (from a worker process)"""
+        for phase, seconds in snapshot.get("phases", {}).items():
+            self.add_time(phase, seconds)
+        for counter, amount in snapshot.get("counters", {}).items():
+            self.count(counter, amount)
+
+    def report(self) -> Dict:
+        """Phases, counters and derived throughput figures"""
+        data = self.snapshot()
+        phases = data["phases"]
+        counters = data["counters"]
+        derived = {"uptime_seconds": time.time() - self.started, "peak_rss_bytes": peak_rss_bytes()}
+        if counters.get("workers"):
+            # The main process figure leaves out the pool workers doing the parsing
+            derived["worker_peak_rss_bytes"] = peak_rss_bytes(children=True)
+
+        entries = counters.get("entries", 0)
+        # Wall time of the whole analysis when main.py timed it; worker phases add up CPU time
+        ingest_seconds = phases.get("analyze") or phases.get("parse", 0.0) + phases.get("aggregate", 0.0)
+        if entries and ingest_seconds:
+            derived["entries_per_second"] = entries / ingest_seconds
+        if counters.get("bytes_read") and phases.get("parse"):
+            derived["parse_bytes_per_second"] = counters["bytes_read"] / phases["parse"]
+        return {"enabled": self.enabled, "phases": phases, "counters": counters, "derived": derived}
+
+
+PROFILER = Profiler()
+
+
+def format_report(report: Dict) -> str:
+    """Render a Profiler report for the console"""
+    lines = ["Profile:"]
+    for phase, seconds in sorted(report["phases"].items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {phase:<28} {seconds:10.3f}s")
+    for counter, amount in sorted(report["counters"].items()):
+        lines.append(f"  {counter:<28} {amount:>11}")
+    derived = report["derived"]
+    if "entries_per_second" in derived:
+        lines.append(f"  {'entries/sec':<28} {derived['entries_per_second']:11.0f}")
+    if "parse_bytes_per_second" in derived:
+        lines.append(f"  {'parse MB/sec':<28} {derived['parse_bytes_per_second'] / 1e6:11.1f}")
+    lines.append(f"  {'peak RSS main process (MB)':<28} {derived['peak_rss_bytes'] / 1e6:11.1f}")
+    if "worker_peak_rss_bytes" in derived:
+        lines.append(f"  {'peak RSS largest worker (MB)':<28} {derived['worker_peak_rss_bytes'] / 1e6:11.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,76 @@
+"""
+MongoDB Query Metrics Analyzer - Roll-up Module
+
+Regroups analyzed results by any sequence of grouping components (see
+analyzer.GROUP_KEYS), with subtotals at every level. Roll-ups are built
+from the per-hash drill-down data kept with the shapes, so any view can be
+computed without re-reading the input.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from analyzer import ShapeAccumulator, component_labels, describe_query_shape
+from profiling import PROFILER
+
+
+@PROFILER.timed("rollup")
+def rollup(shapes: Dict[int, Dict], levels: Sequence[str],
+           exclude_namespace: Optional[Callable[[Any], bool]] = None) -> List[Dict]:
+    """Roll the hashes of `shapes` up by `levels`, one row per group at every level.
+
+    Rows are `{"depth", "labels", "hashes", "result"}` where `labels` are
+    the readable components up to the row's depth and `result` is in the
+    analyze_metrics format. Rows come in tree order: each group is followed
+    by its subgroups, siblings by descending total execution time. Hashes
+    whose namespace matches `exclude_namespace` are left out. Requires the
+    drill-down data of a detailed analysis.
+    """
+    leaves: Dict[tuple, ShapeAccumulator] = {}
+    for shape_info in shapes.values():
+        original_data = shape_info.get("original_data")
+        if original_data is None:
+            raise ValueError("Roll-ups need the per-hash data of a detailed analysis")
+        for hash_val in shape_info["hashes"]:
+            hash_data = original_data[hash_val]
+            namespace = hash_data.get("namespace", "")
+            if exclude_namespace is not None and exclude_namespace(namespace):
+                continue
+            description = describe_query_shape(hash_data["query_shape"])
+            values = tuple(getattr(description, name) for name in levels)
+            accumulator = leaves.get(values)
+            if accumulator is None:
+                accumulator = leaves[values] = ShapeAccumulator(namespace)
+            accumulator.hashes[hash_val] = None
+            accumulator.predicates.add(*description.predicates)
+            for metrics in hash_data["metrics"]:
+                accumulator.add(metrics)
+
+    # Subtotals: merge each leaf into the groups of its prefixes
+    groups: Dict[tuple, ShapeAccumulator] = dict(leaves)
+    children: Dict[tuple, List[tuple]] = {(): []}
+    for values, leaf in leaves.items():
+        for depth in range(1, len(levels) + 1):
+            prefix = values[:depth]
+            if prefix not in children:
+                children[prefix] = []
+                children[values[:depth - 1]].append(prefix)
+            if depth < len(levels):
+                group = groups.get(prefix)
+                if group is None:
+                    group = groups[prefix] = ShapeAccumulator(leaf.namespace)
+                group.merge(leaf)
+
+    rows = []
+    stack = [()]
+    while stack:
+        prefix = stack.pop()
+        if prefix:
+            accumulator = groups[prefix]
+            rows.append({
+                "depth": len(prefix),
+                "labels": component_labels(levels, prefix),
+                "hashes": len(accumulator.hashes),
+                "result": accumulator.to_result()
+            })
+        # Pushed lightest first, so the heaviest subgroup is visited next
+        stack.extend(sorted(children.get(prefix, ()), key=lambda child: groups[child].total_exec_micros))
+    return rows
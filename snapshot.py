@@ -0,0 +1,379 @@
+"""
+MongoDB Query Metrics Analyzer - Analysis Snapshot Module
+
+A snapshot stores the output of analyze_metrics (`results` and `shapes`,
+including the per-hash drill-down data) in a single binary file:
+
+    magic (8 bytes) | version (uint32) | header length (uint64) | JSON header
+    | 8-byte aligned sections...
+
+The JSON header describes the shapes and the location of each section.
+Numeric per-shape results and per-entry metrics (every numeric leaf, e.g.
+`totalExecMicros.sumOfSquares`) are stored as raw columnar arrays, and query
+shapes and any non-numeric entry metrics as JSON blobs addressed by an
+offset index. On load the file is memory-mapped and drill-down data is
+decoded only when accessed.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+from profiling import PROFILER
+
+SNAPSHOT_MAGIC = b"MQSSNAP\0"
+SNAPSHOT_VERSION = 2
+READABLE_VERSIONS = (1, 2)  # Version 1 kept only five entry metrics (see _column_path)
+_PREAMBLE = struct.Struct("<8sIQ")
+_ALIGNMENT = 8
+
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _flatten(result: Dict, prefix: str = "") -> Iterator[Tuple[str, Any]]:
+    """Yield (dotted path, leaf value) pairs of a nested result dict"""
+    for key, value in result.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        else:
+            yield path, value
+
+
+def _unflatten(pairs: Iterator[Tuple[str, Any]]) -> Dict:
+    """Rebuild a nested dict from (dotted path, value) pairs"""
+    result: Dict = {}
+    for path, value in pairs:
+        node = result
+        *parents, leaf = path.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    return result
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _EntryColumns:
+    """Per-entry metrics split into one column per numeric leaf and JSON for the rest.
+
+    Columns stay int64 while every value is an integer (counters and sums
+    of squares exceed float precision), with a mask of the entries missing
+    the metric; any other column is float64 with NaN marking missing values.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, array] = {}
+        self.missing: Dict[str, array] = {}  # Path of an int64 column -> 1 for each entry without it
+        self.rows = 0
+        self.object_offsets = array("Q", [0])
+        self.object_blobs: List[bytes] = []
+        self.object_size = 0
+
+    def add(self, metrics: Dict):
+        columns = self.columns
+        objects = {}
+        for path, value in _flatten(metrics):
+            if not _is_number(value):
+                objects[path] = value
+                continue
+            column = columns.get(path)
+            if column is None:
+                column = columns[path] = array("q", bytes(8 * self.rows))
+                if self.rows:
+                    # A metric first seen now is missing from the earlier entries
+                    self.missing[path] = array("B", b"\1" * self.rows)
+            if column.typecode == "q" and not (isinstance(value, int) and -_INT64_MAX <= value <= _INT64_MAX):
+                column = self._to_float(path)
+            column.append(value)
+        self.rows += 1
+        for path, column in columns.items():
+            if len(column) < self.rows:
+                if column.typecode == "d":
+                    column.append(float("nan"))
+                    continue
+                column.append(0)
+                mask = self.missing.get(path)
+                if mask is None:
+                    mask = self.missing[path] = array("B", bytes(self.rows - 1))
+                mask.append(1)
+            elif path in self.missing:
+                self.missing[path].append(0)
+
+        if objects:
+            blob = json.dumps(objects, separators=(",", ":"), default=str).encode("utf-8")
+            self.object_blobs.append(blob)
+            self.object_size += len(blob)
+        self.object_offsets.append(self.object_size)
+
+    def _to_float(self, path: str) -> array:
+        """Turn an int64 column into float64, its missing entries into NaN"""
+        mask = self.missing.pop(path, None)
+        column = array("d", self.columns[path])
+        if mask is not None:
+            for row, is_missing in enumerate(mask):
+                if is_missing:
+                    column[row] = float("nan")
+        self.columns[path] = column
+        return column
+
+
+class _SectionWriter:
+    """Accumulates aligned binary sections and records their location"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def add(self, data: bytes) -> Dict:
+        padding = -self.size % _ALIGNMENT
+        if padding:
+            self.chunks.append(b"\0" * padding)
+            self.size += padding
+        location = {"offset": self.size, "length": len(data)}
+        self.chunks.append(data)
+        self.size += len(data)
+        return location
+
+    def add_array(self, values: array) -> Dict:
+        location = self.add(values.tobytes())
+        location["typecode"] = values.typecode
+        return location
+
+
+@PROFILER.timed("snapshot.save")
+def save_snapshot(path: str, results: Dict[int, Dict], shapes: Dict[int, Dict]):
+    """Write `results` and `shapes` to a snapshot file at `path`"""
+    sections = _SectionWriter()
+    shape_ids = list(results)
+    detail = all("original_data" in shapes[shape_id] for shape_id in shape_ids)
+
+    # Per-shape results: numeric leaves become columns, anything else goes in the header
+    flat_results = [dict(_flatten(results[shape_id])) for shape_id in shape_ids]
+    paths: Dict[str, None] = {}
+    for flat in flat_results:
+        paths.update(dict.fromkeys(flat))
+    result_columns = {}
+    result_objects = {}
+    result_missing = {}  # Path -> positions of the shapes without it (e.g. topK.belowTopK)
+    for result_path in paths:
+        values = [flat.get(result_path) for flat in flat_results]
+        if all(_is_number(value) for value in values):
+            typecode = "q" if all(isinstance(value, int) for value in values) else "d"
+            result_columns[result_path] = sections.add_array(array(typecode, values))
+        else:
+            result_objects[result_path] = values
+            missing = [position for position, flat in enumerate(flat_results) if result_path not in flat]
+            if missing:
+                result_missing[result_path] = missing
+
+    # Shape descriptions (without the bulky hash data) and the global hash list
+    shape_headers = []
+    hashes: List[str] = []
+    for shape_id in shape_ids:
+        shape_info = shapes[shape_id]
+        extra = {key: value for key, value in shape_info.items() if key not in ("hashes", "original_data")}
+        shape_headers.append({"id": shape_id, "hash_start": len(hashes), "info": extra})
+        hashes.extend(shape_info["hashes"])
+
+    header = {
+        "byteorder": sys.byteorder,
+        "detail": detail,
+        "shapes": shape_headers,
+        "hashes": hashes,
+        "result_columns": result_columns,
+        "result_objects": result_objects,
+        "result_missing": result_missing,
+    }
+
+    if detail:
+        # Per-hash drill-down: query shape blobs, entry ranges and entry metric columns
+        shape_offsets = array("Q", [0])
+        entry_offsets = array("Q", [0])
+        namespaces = []
+        blobs = []
+        entry_columns = _EntryColumns()
+        blob_size = 0
+        for shape_id in shape_ids:
+            original_data = shapes[shape_id]["original_data"]
+            for hash_val in shapes[shape_id]["hashes"]:
+                hash_data = original_data[hash_val]
+                blob = json.dumps(hash_data["query_shape"], separators=(",", ":")).encode("utf-8")
+                blobs.append(blob)
+                blob_size += len(blob)
+                shape_offsets.append(blob_size)
+                namespaces.append(hash_data.get("namespace", ""))
+                for metric in hash_data["metrics"]:
+                    entry_columns.add(metric)
+                entry_offsets.append(entry_columns.rows)
+
+        header["namespaces"] = namespaces
+        header["query_shape_offsets"] = sections.add_array(shape_offsets)
+        header["query_shapes"] = sections.add(b"".join(blobs))
+        header["entry_offsets"] = sections.add_array(entry_offsets)
+        header["entry_columns"] = []
+        for entry_path, column in entry_columns.columns.items():
+            location = dict(sections.add_array(column), path=entry_path)
+            if entry_path in entry_columns.missing:
+                location["missing"] = sections.add_array(entry_columns.missing[entry_path])
+            header["entry_columns"].append(location)
+        if entry_columns.object_size:
+            header["entry_object_offsets"] = sections.add_array(entry_columns.object_offsets)
+            header["entry_objects"] = sections.add(b"".join(entry_columns.object_blobs))
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    data_start = _PREAMBLE.size + len(header_bytes)
+    padding = -data_start % _ALIGNMENT
+
+    with open(path, "wb") as file:
+        file.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        file.write(b"\0" * padding)
+        for chunk in sections.chunks:
+            file.write(chunk)
+
+
+class _Snapshot:
+    """A memory-mapped snapshot file"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREAMBLE.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not an analysis snapshot file")
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+        self.header = json.loads(self.map[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        data_start = _PREAMBLE.size + header_length
+        self.data = memoryview(self.map)[data_start + (-data_start % _ALIGNMENT):]
+        self.swap = self.header["byteorder"] != sys.byteorder
+
+    def array(self, location: Dict):
+        """Zero-copy view of a column (copied only if the byte order differs)"""
+        view = self.data[location["offset"]:location["offset"] + location["length"]].cast(location["typecode"])
+        if self.swap:
+            values = array(location["typecode"], view)
+            values.byteswap()
+            return values
+        return view
+
+    def bytes(self, location: Dict, start: int = 0, end: int = None) -> memoryview:
+        base = location["offset"]
+        return self.data[base + start:base + (location["length"] if end is None else end)]
+
+
+def _column_path(column: Dict) -> str:
+    """Dotted metric path of an entry column (version 1 files name a metric and sub-field)"""
+    if "path" in column:
+        return column["path"]
+    return column["name"] if column["field"] is None else f"{column['name']}.{column['field']}"
+
+
+class _LazyOriginalData(Mapping):
+    """Per-hash drill-down data of one shape, decoded from the snapshot on access"""
+
+    def __init__(self, snapshot: _Snapshot, hashes: List[str], hash_start: int):
+        self._snapshot = snapshot
+        self._hashes = hashes
+        self._hash_start = hash_start
+        self._index = None
+        self._cache: Dict[str, Dict] = {}
+
+    def __getitem__(self, hash_val: str) -> Dict:
+        hash_data = self._cache.get(hash_val)
+        if hash_data is not None:
+            return hash_data
+        if self._index is None:
+            self._index = {value: position for position, value in enumerate(self._hashes)}
+        global_index = self._hash_start + self._index[hash_val]
+
+        snapshot = self._snapshot
+        header = snapshot.header
+        shape_offsets = snapshot.array(header["query_shape_offsets"])
+        blob = snapshot.bytes(header["query_shapes"], shape_offsets[global_index], shape_offsets[global_index + 1])
+
+        entry_offsets = snapshot.array(header["entry_offsets"])
+        start, end = entry_offsets[global_index], entry_offsets[global_index + 1]
+        columns = [(_column_path(column).split("."), column["typecode"] == "d", snapshot.array(column),
+                    snapshot.array(column["missing"]) if "missing" in column else None)
+                   for column in header["entry_columns"]]
+        object_offsets = snapshot.array(header["entry_object_offsets"]) if "entry_objects" in header else None
+        metrics = []
+        for row in range(start, end):
+            metric = {}
+            for (*parents, leaf), is_float, values, missing in columns:
+                if missing is not None and missing[row]:
+                    continue
+                value = values[row]
+                if is_float:
+                    if value != value:  # NaN marks a metric missing from the entry
+                        continue
+                    value = int(value) if value.is_integer() else value
+                node = metric
+                for parent in parents:
+                    node = node.setdefault(parent, {})
+                node[leaf] = value
+            if object_offsets is not None and object_offsets[row] != object_offsets[row + 1]:
+                objects = json.loads(bytes(snapshot.bytes(header["entry_objects"],
+                                                          object_offsets[row], object_offsets[row + 1])))
+                for (*parents, leaf), value in ((path.split("."), value) for path, value in objects.items()):
+                    node = metric
+                    for parent in parents:
+                        node = node.setdefault(parent, {})
+                    node[leaf] = value
+            metrics.append(metric)
+
+        hash_data = {
+            "query_shape": json.loads(bytes(blob)),
+            "metrics": metrics,
+            "namespace": header["namespaces"][global_index]
+        }
+        self._cache[hash_val] = hash_data
+        return hash_data
+
+    def __iter__(self):
+        return iter(self._hashes)
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+@PROFILER.timed("snapshot.load")
+def load_snapshot(path: str) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+    """Open a snapshot written by save_snapshot and return `(results, shapes)`.
+
+    Per-shape results are materialised immediately; per-hash drill-down data
+    stays in the memory-mapped file until it is looked up.
+    """
+    file = open(path, "rb")
+    snapshot = _Snapshot(file)
+    header = snapshot.header
+
+    columns = {result_path: snapshot.array(location) for result_path, location in header["result_columns"].items()}
+    missing = {result_path: set(positions) for result_path, positions in header.get("result_missing", {}).items()}
+    results = {}
+    shapes = {}
+    all_hashes = header["hashes"]
+    shape_headers = header["shapes"]
+    for position, shape_header in enumerate(shape_headers):
+        shape_id = shape_header["id"]
+        pairs = [(result_path, values[position]) for result_path, values in columns.items()]
+        pairs.extend((result_path, values[position]) for result_path, values in header["result_objects"].items()
+                     if position not in missing.get(result_path, ()))
+        results[shape_id] = _unflatten(iter(pairs))
+
+        hash_start = shape_header["hash_start"]
+        hash_end = shape_headers[position + 1]["hash_start"] if position + 1 < len(shape_headers) else len(all_hashes)
+        hashes = all_hashes[hash_start:hash_end]
+        shape_info = dict(shape_header["info"], hashes=hashes)
+        if header["detail"]:
+            shape_info["original_data"] = _LazyOriginalData(snapshot, hashes, hash_start)
+        shapes[shape_id] = shape_info
+
+    return results, shapes
@@ -0,0 +1,129 @@
+"""
+MongoDB Query Metrics Analyzer - Watch Module
+
+Polls input files and directories for new queryStats data and feeds only
+what is new into an entry-tracking MetricsAggregator.
+"""
+import os
+from typing import BinaryIO, Dict, Sequence
+
+from analyzer import MetricsAggregator
+from ingest import expand_input_paths, iter_batch_entries, iter_stream_entries
+
+APPEND_EXTENSIONS = (".ndjson", ".jsonl")  # Files that grow by appended lines
+
+
+class _FileState:
+    """What has already been ingested from one file"""
+    __slots__ = ("offset", "size", "mtime", "inode")
+
+    def __init__(self):
+        self.offset = 0
+        self.size = -1
+        self.mtime = -1.0
+        self.inode = -1
+
+
+class DumpWatcher:
+    """Incrementally ingest queryStats dumps as they appear or grow.
+
+    Inputs are re-expanded on every poll, so new files dropped into a
+    watched directory are picked up. Newline-delimited files are read from
+    the offset reached by the previous poll, up to the last complete line;
+    other dumps are read in full whenever they are replaced or modified.
+    Re-read entries update the aggregates by their cumulative deltas (see
+    MetricsAggregator's `track_entries`).
+    """
+
+    def __init__(self, inputs: Sequence[str], aggregator: MetricsAggregator):
+        if aggregator.entries is None:
+            raise ValueError("DumpWatcher needs a MetricsAggregator created with track_entries=True")
+        self.inputs = list(inputs)
+        self.aggregator = aggregator
+        self._files: Dict[str, _FileState] = {}
+
+    def poll(self) -> int:
+        """Ingest whatever is new since the last poll and return the number of entries read"""
+        count = 0
+        for path in expand_input_paths(self.inputs):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            state = self._files.get(path)
+            if state is None:
+                state = self._files[path] = _FileState()
+            if stat.st_size == state.size and stat.st_mtime == state.mtime and stat.st_ino == state.inode:
+                continue
+
+            if path.endswith(APPEND_EXTENSIONS):
+                # Start over if the file was replaced or truncated
+                if stat.st_ino != state.inode or stat.st_size < state.offset:
+                    state.offset = 0
+                count += self._read_appended(path, state)
+            else:
+                try:
+                    count += self._read_whole(path)
+                except ValueError as e:
+                    # Most likely still being written: keep the state so the next poll retries it
+                    print(f"Warning: Could not read {path} yet, retrying on the next poll: {e}")
+                    continue
+
+            state.size = stat.st_size
+            state.mtime = stat.st_mtime
+            state.inode = stat.st_ino
+        return count
+
+    def _read_whole(self, path: str) -> int:
+        """Ingest a whole dump; raises ValueError (e.g. JSONDecodeError) if it is incomplete"""
+        count = 0
+        add = self.aggregator.add
+        for batch in iter_batch_entries(path):
+            add(batch)
+            count += 1
+        return count
+
+    def _read_appended(self, path: str, state: _FileState) -> int:
+        count = 0
+        add = self.aggregator.add
+        with open(path, 'rb') as file:
+            lines = _CompleteLines(file, state.offset)
+            try:
+                for batch in iter_stream_entries(lines):
+                    add(batch)
+                    count += 1
+            finally:
+                state.offset = lines.offset
+        return count
+
+
+class _CompleteLines:
+    """Text reader over the complete lines of a binary file, from an offset.
+
+    Reads a chunk at a time and stops before a partially written last line,
+    which is left for the next poll; `offset` is the position after the
+    last line handed out.
+    """
+
+    def __init__(self, file: BinaryIO, offset: int):
+        self.file = file
+        self.offset = offset
+        file.seek(offset)
+
+    def read(self, size: int = -1) -> str:
+        data = self.file.read(size)
+        end = data.rfind(b"\n") + 1
+        # A line longer than the chunk: read on until it ends
+        while not end and data:
+            more = self.file.read(size)
+            if not more:
+                break
+            data += more
+            end = data.rfind(b"\n") + 1
+        if not end:
+            self.file.seek(self.offset)
+            return ""
+        self.offset += end
+        self.file.seek(self.offset)
+        return data[:end].decode('utf-8')
@@ -1,47 +1,172 @@
 """
 MongoDB Query Metrics Analyzer - Web Server Module
 """
-import os
+import gzip
+import hashlib
 import json as json_lib
-from flask import Flask, render_template, jsonify, request
+import threading
+import time
+from array import array
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
 
-def create_web_server(analyzed_results, shape_references):
-    """Create and configure Flask app with routes"""
-    app = Flask(__name__)
-    
-    @app.route('/')
-    def index():
-        """Main page with summary table"""
-        return render_template('index.html')
-    
-    @app.route('/api/data')
-    def get_data():
-        """API endpoint to get the analyzed data"""
+from flask import Flask, Response, g, render_template, request
+
+from analyzer import GROUP_KEYS, parse_group_by, shape_cache_info
+from assets import VendoredAssets
+from efficiency import efficiency_scores
+from profiling import PROFILER
+from rollup import rollup
+
+API_GZIP_MIN_BYTES = 1024  # Smaller JSON bodies are sent as they are
+API_GZIP_LEVEL = 6
+
+def format_namespace(ns_value: Any) -> Tuple[str, bool]:
+    """Format a cmdNs value as 'db.coll'; the flag is set for the admin database"""
+    if isinstance(ns_value, dict) and 'db' in ns_value and 'coll' in ns_value:
+        if ns_value['db'] == 'admin':
+            return "", True
+        return f"{ns_value['db']}.{ns_value['coll']}", False
+    return (str(ns_value) if ns_value is not None else ""), False
+
+
+class Payload:
+    """A pre-serialized JSON response body with its ETag (and gzipped body, once requested)"""
+    __slots__ = ("body", "etag", "status", "_gzip_body")
+
+    def __init__(self, data: Any, status: int = 200):
+        self.body = json_lib.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self.status = status
+        self._gzip_body: Optional[bytes] = None
+
+    def gzip_body(self) -> bytes:
+        """The body gzip-compressed, compressed on first use"""
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.body, compresslevel=API_GZIP_LEVEL, mtime=0)
+        return self._gzip_body
+
+
+class RowTable:
+    """Rows of one table with presorted index arrays for server-side paging.
+
+    Sort orders are computed once per column, on first use, so each page
+    request only walks the rows it returns (plus a filter pass when a search
+    term is given).
+    """
+
+    def __init__(self, rows: List[Dict], search_texts: List[str]):
+        self.rows = rows
+        self.search_texts = search_texts
+        self.columns = set().union(*rows)  # Every column of any row (some rows may lack some)
+        self._orders: Dict[str, array] = {}
+
+    def order(self, column: str) -> array:
+        """Row indexes sorted ascending by `column`"""
+        order = self._orders.get(column)
+        if order is None:
+            rows = self.rows
+            order = array("I", sorted(range(len(rows)), key=lambda position: _sort_key(rows[position].get(column))))
+            self._orders[column] = order
+        return order
+
+    def page(self, column: str, descending: bool, search: str, start: int, length: int) -> Tuple[int, List[Dict]]:
+        """Return `(filtered row count, rows of the requested page)`"""
+        order = self.order(column) if column else array("I", range(len(self.rows)))
+        positions = reversed(order) if descending else iter(order)
+        end = None if length < 0 else start + length
+
+        if search:
+            search = search.lower()
+            texts = self.search_texts
+            matching = [position for position in positions if search in texts[position]]
+            return len(matching), [self.rows[position] for position in matching[start:end]]
+
+        return len(self.rows), [self.rows[position] for position in islice(positions, start, end)]
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    """Sort key tolerating mixed cell types: numbers, then text, then missing values"""
+    if value is None:
+        return 2, ""
+    if isinstance(value, (int, float)):
+        return 0, value
+    return 1, str(value)
+
+
+def _datatables_page(table: RowTable, extra: Dict = None) -> Response:
+    """Answer a DataTables server-side processing request from `table`"""
+    args = request.args
+    column = ""
+    sort_index = args.get("order[0][column]")
+    if sort_index is not None:
+        column = args.get(f"columns[{sort_index}][data]", "")
+        if column not in table.columns:
+            column = ""
+
+    data = {
+        "draw": args.get("draw", type=int, default=0),
+        "recordsTotal": len(table.rows),
+    }
+    data["recordsFiltered"], data["data"] = table.page(
+        column,
+        args.get("order[0][dir]", "asc") == "desc",
+        args.get("search[value]", "").strip(),
+        max(args.get("start", type=int, default=0), 0),
+        args.get("length", type=int, default=25),
+    )
+    if extra:
+        data.update(extra)
+    return Response(json_lib.dumps(data, separators=(",", ":")), mimetype="application/json")
+
+
+class ApiIndex:
+    """Lookup tables and cached payloads behind the JSON API.
+
+    The hash-to-shape index, formatted namespaces and the summary payload
+    are built up front; per-shape and per-hash payloads are serialized on
+    first request and then served from cache.
+    """
+
+    @PROFILER.timed("api.index")
+    def __init__(self, analyzed_results: Dict[int, Dict], shape_references: Dict[int, Dict]):
+        self.results = analyzed_results
+        self.shapes = shape_references
+        self.hash_to_shape: Dict[str, int] = {}
+        self.shape_namespaces: Dict[int, Tuple[str, bool]] = {}
+        self._shape_payloads: Dict[int, Payload] = {}
+        self._shape_details: Dict[int, Tuple[Dict, RowTable]] = {}
+        self._query_payloads: Dict[str, Payload] = {}
+        self._rollup_payloads: Dict[Tuple[str, ...], Payload] = {}
+        self._diff_table: Optional[RowTable] = None
+
+        for shape_id, shape_info in shape_references.items():
+            for hash_val in shape_info["hashes"]:
+                self.hash_to_shape[hash_val] = shape_id
+            self.shape_namespaces[shape_id] = format_namespace(shape_info.get("namespace", ""))
+
+        self.has_latency = any("latencyMillis" in result for result in analyzed_results.values())
+        self.has_groups = any("group" in shape_info for shape_info in shape_references.values())
+        data = self._build_data()
+        self.data_payload = Payload(data)
+        self.data_table = RowTable(data, [
+            f"{row['shapeId']} {row['namespace']} {' '.join(shape_references[row['id']]['field_names'])} "
+            f"{row.get('group', '')}".lower()
+            for row in data
+        ])
+
+    def _build_data(self) -> List[Dict]:
         data = []
-        for shape_id, result in analyzed_results.items():
-            # Get namespace from the first hash in this shape
-            shape_info = shape_references[shape_id]
-            first_hash = shape_info["hashes"][0] if shape_info["hashes"] else ""
-            # Format namespace as 'db.coll'
-            namespace = ""
-            skip_this_shape = False
-            if first_hash:
-                ns_value = shape_info["original_data"][first_hash].get("namespace", "")
-                if isinstance(ns_value, dict) and 'db' in ns_value and 'coll' in ns_value:
-                    # Skip if db is 'admin'
-                    if ns_value['db'] == 'admin':
-                        skip_this_shape = True
-                    else:
-                        namespace = f"{ns_value['db']}.{ns_value['coll']}"
-                else:
-                    namespace = str(ns_value) if ns_value is not None else ""
-            
+        for shape_id, result in self.results.items():
+            namespace, is_admin = self.shape_namespaces[shape_id]
             # Skip admin databases
-            if skip_this_shape:
+            if is_admin:
                 continue
-                
+
+            # The roll-up of shapes outside the top K (see heavy_hitters)
+            is_other = result.get("topK", {}).get("other", False)
             row = {
-                "shapeId": f"Shape {shape_id}",
+                "shapeId": "Other" if is_other else f"Shape {shape_id}",
                 "namespace": namespace,
                 "shapesCount": result["shapes_count"],
                 "execCountTotal": result["execCount"]["total"],
@@ -55,117 +180,340 @@ def create_web_server(analyzed_results, shape_references):
                 "docsExaminedAvg": round(result["docsExamined"]["avg"], 2),
                 "id": shape_id  # For drill-down
             }
+            # Efficiency scores (see efficiency); missing from snapshots of earlier versions
+            efficiency = result.get("efficiency", {})
+            row.update({
+                "docsExaminedPerReturned": round(efficiency.get("docsExaminedPerReturned", 0), 2),
+                "keysExaminedPerReturned": round(efficiency.get("keysExaminedPerReturned", 0), 2),
+                "collScanLikelihood": round(efficiency.get("collScanLikelihood", 0), 2),
+                "wastedExecMillis": round(efficiency.get("wastedExecMillis", 0), 2),
+                "indexCandidate": efficiency.get("indexCandidate", "")
+            })
+            # Components of the grouping key, when grouped by more than the field names (see --group-by)
+            # (the top-K "Other" roll-up has none, but every row gets the column)
+            if self.has_groups:
+                group = self.shapes[shape_id].get("group", {})
+                row["group"] = "; ".join(f"{name}={label}" for name, label in group.items())
+            # Latency distribution columns, when the engine provides them (see numpy_engine)
+            latency = result.get("latencyMillis")
+            if latency:
+                row.update({
+                    "latencyStddevMillis": round(latency["stddev"], 2),
+                    "latencyMinMillis": round(latency["min"], 2),
+                    "latencyMaxMillis": round(latency["max"], 2),
+                    "latencyP50Millis": round(latency["p50"], 2),
+                    "latencyP95Millis": round(latency["p95"], 2),
+                    "latencyP99Millis": round(latency["p99"], 2)
+                })
             data.append(row)
-        
-        return jsonify(data)
+        return data
+
+    def shape_payload(self, shape_id: int) -> Payload:
+        payload = self._shape_payloads.get(shape_id)
+        if payload is None:
+            shape_details = self.shape_details(shape_id)
+            # Only cache shapes that exist, so unknown URLs cannot grow the cache
+            if shape_details is None:
+                return Payload({"error": "Shape not found"}, 404)
+            payload = self._shape_payloads[shape_id] = Payload(shape_details[0])
+        return payload
+
+    def shape_details(self, shape_id: int) -> Optional[Tuple[Dict, RowTable]]:
+        """The drill-down dict of a shape and a RowTable over its detail rows"""
+        if shape_id not in self.shapes:
+            return None
+        shape_details = self._shape_details.get(shape_id)
+        if shape_details is None:
+            shape_data = self._build_shape(shape_id)
+            details = shape_data["details"]
+            table = RowTable(details, [f"{row['hash']} {row['namespace']}".lower() for row in details])
+            shape_details = self._shape_details[shape_id] = (shape_data, table)
+        return shape_details
+
+    def _build_shape(self, shape_id: int) -> Dict:
+        shape_info = self.shapes[shape_id]
+
+        # Prepare hash details for drill-down
+        hash_details = []
+        for hash_val in shape_info["hashes"]:
+            hash_data = shape_info["original_data"][hash_val]
+            namespace, is_admin = format_namespace(hash_data.get("namespace", ""))
+            # Skip admin databases
+            if is_admin:
+                continue
+
+            hash_display = hash_val[:8] + "..."  # Truncated hash for display
+            # Process metrics for this hash
+            for metric in hash_data["metrics"]:
+                exec_count = metric.get("execCount", 0)
+                total_exec_micros = metric.get("totalExecMicros", {}).get("sum", 0)
+                avg_exec_ms = (total_exec_micros / exec_count) / 1000.0 if exec_count > 0 else 0
+                docs_returned = metric.get("docsReturned", {}).get("sum", 0)
+                keys_examined = metric.get("keysExamined", {}).get("sum", 0)
+                docs_examined = metric.get("docsExamined", {}).get("sum", 0)
+                efficiency = efficiency_scores(total_exec_micros, docs_returned, keys_examined, docs_examined)
+
+                hash_details.append({
+                    "hash": hash_val,  # Full hash for query details
+                    "hashDisplay": hash_display,
+                    "namespace": namespace,
+                    "execCount": exec_count,
+                    "avgExecMs": round(avg_exec_ms, 2),
+                    "totalExecMs": round(total_exec_micros / 1000.0, 2),
+                    "docsReturned": docs_returned,
+                    "keysExamined": keys_examined,
+                    "docsExamined": docs_examined,
+                    "docsExaminedPerReturned": round(efficiency["docsExaminedPerReturned"], 2),
+                    "collScanLikelihood": round(efficiency["collScanLikelihood"], 2),
+                    "wastedExecMs": round(efficiency["wastedExecMillis"], 2)
+                })
+
+        return {
+            "shapeId": f"Shape {shape_id}",
+            "namespace": self.shape_namespaces[shape_id][0],
+            "fieldNames": shape_info["field_names"],
+            "indexCandidate": self.results.get(shape_id, {}).get("efficiency", {}).get("indexCandidate", ""),
+            "details": hash_details
+        }
+
+    def rollup_payload(self, levels: Tuple[str, ...]) -> Payload:
+        """Rows of the hashes rolled up by `levels` (see rollup), built on first use"""
+        payload = self._rollup_payloads.get(levels)
+        if payload is None:
+            try:
+                rows = rollup(self.shapes, levels, exclude_namespace=lambda namespace: format_namespace(namespace)[1])
+            except ValueError as e:
+                return Payload({"error": str(e)}, 400)
+            data = []
+            for row in rows:
+                result = row["result"]
+                efficiency = result["efficiency"]
+                data.append({
+                    "depth": row["depth"],
+                    "labels": row["labels"],
+                    "hashes": row["hashes"],
+                    "entries": result["shapes_count"],
+                    "execCountTotal": result["execCount"]["total"],
+                    "totalExecMillis": round(result["totalExecMillis"]["total"], 2),
+                    "avgExecMillis": round(result["avgExecMillis"]["avg"], 2),
+                    "docsExaminedTotal": result["docsExamined"]["total"],
+                    "docsExaminedPerReturned": round(efficiency["docsExaminedPerReturned"], 2),
+                    "wastedExecMillis": round(efficiency["wastedExecMillis"], 2),
+                    "indexCandidate": efficiency["indexCandidate"]
+                })
+            payload = self._rollup_payloads[levels] = Payload({"levels": list(levels), "rows": data})
+        return payload
+
+    def diff_table(self) -> RowTable:
+        """Rows of the interval view (results of delta.diff_entries), built on first use"""
+        if self._diff_table is None:
+            rows = []
+            for shape_id, result in self.results.items():
+                namespace, is_admin = self.shape_namespaces[shape_id]
+                # Skip admin databases
+                if is_admin:
+                    continue
+
+                rates = result.get("rates", {})
+                rows.append({
+                    "shapeId": f"Shape {shape_id}",
+                    "namespace": namespace,
+                    "shapesCount": result["shapes_count"],
+                    "execCount": result["execCount"]["total"],
+                    "totalExecMillis": round(result["totalExecMillis"]["total"], 2),
+                    "docsExamined": result["docsExamined"]["total"],
+                    "keysExamined": result["keysExamined"]["total"],
+                    "execsPerSec": round(rates.get("execsPerSec", 0), 2),
+                    "execMillisPerSec": round(rates.get("execMillisPerSec", 0), 2),
+                    "docsExaminedPerSec": round(rates.get("docsExaminedPerSec", 0), 2),
+                    "id": shape_id  # For drill-down
+                })
+            self._diff_table = RowTable(rows, [
+                f"{row['shapeId']} {row['namespace']} {' '.join(self.shapes[row['id']]['field_names'])}".lower()
+                for row in rows
+            ])
+        return self._diff_table
+
+    @property
+    def interval_seconds(self) -> Optional[float]:
+        """Length of the diffed interval, if the results carry rates"""
+        for result in self.results.values():
+            if "rates" in result:
+                return result["rates"]["intervalSeconds"]
+        return None
+
+    def query_payload(self, hash_val: str) -> Payload:
+        payload = self._query_payloads.get(hash_val)
+        if payload is None:
+            payload = self._build_query(hash_val)
+            # Only cache hashes that exist, so unknown URLs cannot grow the cache
+            if payload.status == 200:
+                self._query_payloads[hash_val] = payload
+        return payload
+
+    def _build_query(self, hash_val: str) -> Payload:
+        shape_id = self.hash_to_shape.get(hash_val)
+        if shape_id is None:
+            return Payload({"error": "Query hash not found"}, 404)
+
+        query_data = self.shapes[shape_id]["original_data"][hash_val]
+        namespace, is_admin = format_namespace(query_data.get("namespace", ""))
+        # Skip admin databases
+        if is_admin:
+            return Payload({"error": "Query hash not found"}, 404)
+
+        # Extract command and pipeline information
+        query_shape = query_data.get("query_shape", {})
+        return Payload({
+            "command": query_shape.get("command", "Unknown"),
+            "namespace": namespace,
+            "pipeline": query_shape.get("pipeline", []),
+            "fullQueryShape": query_shape,
+            "shapeId": shape_id
+        })
+
+
+def _accepts_gzip(size: int) -> bool:
+    """Whether a JSON body of `size` bytes should be sent gzip-compressed to this client"""
+    return size >= API_GZIP_MIN_BYTES and bool(request.accept_encodings["gzip"])
+
+
+def _payload_response(payload: Payload) -> Response:
+    """Serve a cached payload, answering conditional requests with 304"""
+    if _accepts_gzip(len(payload.body)):
+        # Each encoding is its own representation, with its own ETag
+        response = Response(payload.gzip_body(), status=payload.status, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(payload.etag + "-gzip")
+    else:
+        response = Response(payload.body, status=payload.status, mimetype="application/json")
+        response.set_etag(payload.etag)
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(request)
+
+
+def create_web_server(analyzed_results, shape_references, progress=None):
+    """Create and configure Flask app with routes.
+
+    `progress` is the AnalysisProgress of a background analysis still
+    filling in the results, if any.
+    """
+    app = Flask(__name__)
+    vendored_assets = VendoredAssets()
+    app.jinja_env.globals["asset_url"] = vendored_assets.url
+    # Swapped wholesale by refresh_web_server, so requests always see one consistent index
+    app.api_index = ApiIndex(analyzed_results, shape_references)
+    app.analysis_progress = progress
+    
+    @app.before_request
+    def start_request_timer():
+        if PROFILER.enabled:
+            g.request_started = time.perf_counter()
+    
+    @app.teardown_request
+    def stop_request_timer(exc):
+        started = g.pop("request_started", None)
+        if started is not None:
+            endpoint = request.endpoint or "unmatched"
+            PROFILER.add_time(f"request.{endpoint}", time.perf_counter() - started)
+            PROFILER.count(f"requests.{endpoint}")
+    
+    @app.after_request
+    def compress_json(response):
+        """Gzip JSON responses built per request (cached payloads come compressed already)"""
+        if (response.mimetype == "application/json" and response.status_code == 200
+                and not response.direct_passthrough and "Content-Encoding" not in response.headers):
+            response.vary.add("Accept-Encoding")
+            body = response.get_data()
+            if _accepts_gzip(len(body)):
+                response.set_data(gzip.compress(body, compresslevel=API_GZIP_LEVEL))
+                response.headers["Content-Encoding"] = "gzip"
+        return response
+    
+    @app.route('/vendor/<path:filename>')
+    def vendor_asset(filename):
+        """Vendored JavaScript and CSS (see assets), cached by browsers for a year"""
+        return vendored_assets.response(filename)
+    
+    @app.route('/')
+    def index():
+        """Main page with summary table"""
+        return render_template('index.html')
+    
+    @app.route('/api/data')
+    def get_data():
+        """API endpoint to get the analyzed data (one page when called by DataTables)"""
+        api_index = app.api_index
+        if 'draw' in request.args:
+            return _datatables_page(api_index.data_table, {"latencyColumns": api_index.has_latency,
+                                                           "groupColumn": api_index.has_groups})
+        return _payload_response(api_index.data_payload)
     
     @app.route('/api/shape/<int:shape_id>')
     def get_shape_details(shape_id):
-        """API endpoint to get details for a specific shape"""
-        if shape_id in shape_references:
-            shape_info = shape_references[shape_id]
-            field_names = shape_info["field_names"]
-            
-            # Prepare hash details for drill-down
-            hash_details = []
-            for hash_val in shape_info["hashes"]:
-                hash_data = shape_info["original_data"][hash_val]
-                # Format namespace as 'db.coll'
-                ns_value = hash_data.get("namespace", "")
-                skip_this_hash = False
-                if isinstance(ns_value, dict) and 'db' in ns_value and 'coll' in ns_value:
-                    # Skip if db is 'admin'
-                    if ns_value['db'] == 'admin':
-                        skip_this_hash = True
-                    else:
-                        namespace = f"{ns_value['db']}.{ns_value['coll']}"
-                else:
-                    namespace = str(ns_value) if ns_value is not None else ""
-                
-                # Skip admin databases
-                if skip_this_hash:
-                    continue
-                
-                # Process metrics for this hash
-                for metric in hash_data["metrics"]:
-                    avg_exec_ms = 0
-                    if "totalExecMicros" in metric and "sum" in metric["totalExecMicros"] and metric.get("execCount", 0) > 0:
-                        avg_exec_ms = (metric["totalExecMicros"]["sum"] / metric["execCount"]) / 1000.0
-                    
-                    hash_details.append({
-                        "hash": hash_val,  # Full hash for query details
-                        "hashDisplay": hash_val[:8] + "...",  # Truncated hash for display
-                        "namespace": namespace,
-                        "execCount": metric.get("execCount", 0),
-                        "avgExecMs": round(avg_exec_ms, 2),
-                        "totalExecMs": round(metric.get("totalExecMicros", {}).get("sum", 0) / 1000.0, 2),
-                        "docsReturned": metric.get("docsReturned", {}).get("sum", 0),
-                        "keysExamined": metric.get("keysExamined", {}).get("sum", 0) if "keysExamined" in metric else 0,
-                        "docsExamined": metric.get("docsExamined", {}).get("sum", 0) if "docsExamined" in metric else 0
-                    })
-            
-            # Get namespace for this shape (using the first hash)
-            first_hash = shape_info["hashes"][0] if shape_info["hashes"] else ""
-            # Format namespace as 'db.coll'
-            namespace = ""
-            if first_hash:
-                ns_value = shape_info["original_data"][first_hash].get("namespace", "")
-                if isinstance(ns_value, dict) and 'db' in ns_value and 'coll' in ns_value:
-                    # Skip if db is 'admin'
-                    if ns_value['db'] == 'admin':
-                        # Just use an empty string if it's admin
-                        namespace = ""
-                    else:
-                        namespace = f"{ns_value['db']}.{ns_value['coll']}"
-                else:
-                    namespace = str(ns_value) if ns_value is not None else ""
-            
-            return jsonify({
-                "shapeId": f"Shape {shape_id}",
-                "namespace": namespace,
-                "fieldNames": field_names,
-                "details": hash_details
-            })
-        
-        return jsonify({"error": "Shape not found"}), 404
+        """API endpoint to get details for a specific shape (one page when called by DataTables)"""
+        api_index = app.api_index
+        if 'draw' in request.args:
+            shape_details = api_index.shape_details(shape_id)
+            if shape_details is None:
+                return _payload_response(api_index.shape_payload(shape_id))
+            shape_data, table = shape_details
+            extra = {key: value for key, value in shape_data.items() if key != "details"}
+            return _datatables_page(table, extra)
+        return _payload_response(api_index.shape_payload(shape_id))
     
     @app.route('/api/query_details/<hash_val>')
     def get_query_details(hash_val):
         """API endpoint to get detailed query information for a specific hash"""
-        for shape_id, shape_info in shape_references.items():
-            if hash_val in shape_info["hashes"]:
-                query_data = shape_info["original_data"][hash_val]
-                # Format namespace as 'db.coll'
-                ns_value = query_data.get("namespace", "")
-                skip_this_query = False
-                if isinstance(ns_value, dict) and 'db' in ns_value and 'coll' in ns_value:
-                    # Skip if db is 'admin'
-                    if ns_value['db'] == 'admin':
-                        skip_this_query = True
-                    else:
-                        namespace = f"{ns_value['db']}.{ns_value['coll']}"
-                else:
-                    namespace = str(ns_value) if ns_value is not None else ""
-                
-                # Skip admin databases
-                if skip_this_query:
-                    continue
-                
-                # Extract command and pipeline information
-                command_type = query_data.get("query_shape", {}).get("command", "Unknown")
-                pipeline = query_data.get("query_shape", {}).get("pipeline", [])
-                
-                # Format JSON for display
-                formatted_data = {
-                    "command": command_type,
-                    "namespace": namespace,
-                    "pipeline": pipeline,
-                    "fullQueryShape": query_data.get("query_shape", {})
-                }
-                
-                return jsonify(formatted_data)
-        
-        return jsonify({"error": "Query hash not found"}), 404
+        return _payload_response(app.api_index.query_payload(hash_val))
+    
+    @app.route('/api/diff')
+    def get_diff():
+        """API endpoint to get per-shape activity between two snapshots (DataTables protocol)"""
+        api_index = app.api_index
+        return _datatables_page(api_index.diff_table(), {"intervalSeconds": api_index.interval_seconds})
+    
+    @app.route('/api/rollup')
+    def get_rollup():
+        """API endpoint to get the hashes rolled up by grouping components, e.g. ?by=namespace,command"""
+        try:
+            levels = parse_group_by(request.args.get("by", "namespace"))
+        except ValueError as e:
+            return Response(json_lib.dumps({"error": str(e)}), status=400, mimetype="application/json")
+        return _payload_response(app.api_index.rollup_payload(levels))
+    
+    @app.route('/api/progress')
+    def get_progress():
+        """API endpoint to get the progress of the analysis behind the served results"""
+        progress = app.analysis_progress
+        data = progress.to_dict() if progress is not None else {"state": "done", "version": 0}
+        response = Response(json_lib.dumps(data, separators=(",", ":")), mimetype="application/json")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    
+    @app.route('/api/_metrics')
+    def get_metrics():
+        """API endpoint to get profiling phases, counters and the state of the caches"""
+        api_index = app.api_index
+        report = PROFILER.report()
+        report["shapeCache"] = shape_cache_info()._asdict()
+        report["apiIndex"] = {
+            "shapes": len(api_index.results),
+            "hashes": len(api_index.hash_to_shape),
+            "cachedShapePayloads": len(api_index._shape_payloads),
+            "cachedQueryPayloads": len(api_index._query_payloads),
+        }
+        return Response(json_lib.dumps(report, separators=(",", ":")), mimetype="application/json")
+    
+    @app.route('/rollup')
+    def rollup_page():
+        """Page to roll query shapes up by namespace, command, fields and other components"""
+        return render_template('rollup.html', group_keys=GROUP_KEYS)
+    
+    @app.route('/diff')
+    def diff_page():
+        """Page to show per-shape activity between two snapshots"""
+        return render_template('diff.html')
     
     @app.route('/shape/<int:shape_id>')
     def shape_details_page(shape_id):
@@ -179,6 +527,23 @@ def create_web_server(analyzed_results, shape_references):
     
     return app
 
+def start_web_server(app, host: str = "127.0.0.1", port: int = 5000):
+    """Serve `app` on a daemon thread and return the server.
+
+    The listening socket is bound before this returns, so the server is
+    ready for requests (e.g. from a browser opened right after).
+    """
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="web-server", daemon=True)
+    thread.start()
+    return server
+
+def refresh_web_server(app, analyzed_results, shape_references):
+    """Serve new analysis results from a running app without restarting it"""
+    app.api_index = ApiIndex(analyzed_results, shape_references)
+
 # No need to generate templates as they're now stored in the templates directory
 def create_templates():
     """Function kept for backwards compatibility, does nothing now"""